@@ -0,0 +1,314 @@
+# 性能基准：在本机回环地址上启动多虚拟主机的HTTP/HTTPS测试服务器，用固定的目标集跑碰撞引擎
+# 报告速率、延迟分位数、峰值内存和CPU时间，并对目标生成和标题提取做微基准，便于在提交之间对比
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+# Windows上没有resource模块，峰值内存和CPU时间改用os.times
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCH_DOMAIN = "bench.test"
+
+def vhost_name(index):
+    return f"v{index}.{BENCH_DOMAIN}"
+
+def make_body(title, size):
+    # 生成指定大小的HTML页面，标题放在开头
+    head = f"<html><head><title>{title}</title></head><body>".encode('utf-8')
+    tail = b"</body></html>"
+    return head + b"x" * max(size - len(head) - len(tail), 0) + tail
+
+def make_certificate(directory):
+    # 用openssl生成自签名证书，没有openssl时返回None，只测HTTP
+    if not shutil.which('openssl'):
+        return None
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key, '-out', cert,
+         '-days', '1', '-subj', f'/CN=*.{BENCH_DOMAIN}'],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+def unused_port():
+    # 绑定后立即关闭，得到一个没有服务监听的端口，用来模拟不存活的端点
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# 本机测试服务器：已知虚拟主机返回各自的页面，其余Host统一返回默认站点
+class BenchServer:
+    def __init__(self, vhosts=50, endpoints=20, https_endpoints=5, latency=5.0, jitter=2.0,
+                 dead_share=0.1, slow_share=0.1, slow_latency=2000.0,
+                 body_size=2048, large_share=0.1, large_size=1024 * 1024, seed=1):
+        self.rng = random.Random(seed)
+        self.endpoints = endpoints
+        self.https_endpoints = https_endpoints
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.slow_latency = slow_latency / 1000
+        self.dead_share = dead_share
+        self.slow_share = slow_share
+        self.bodies = {}
+        for i in range(vhosts):
+            size = large_size if self.rng.random() < large_share else body_size
+            self.bodies[vhost_name(i)] = make_body(f"站点{i}", size)
+        self.default_body = make_body("Default Site", body_size)
+        self.ports = []       # 全部端口，包括不存活的
+        self.live_ports = []
+        self.servers = []
+        self.loop = None
+        self.thread = None
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    async def handle(self, reader, writer, latency):
+        # 支持长连接，每个请求按端点的延迟返回
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                host = ''
+                for line in head.split(b'\r\n')[1:]:
+                    name, _, value = line.partition(b':')
+                    if name.strip().lower() == b'host':
+                        host = value.strip().decode('latin-1').rsplit(':', 1)[0].lower()
+                        break
+                await asyncio.sleep(latency + self.rng.uniform(0, self.jitter))
+                body = self.bodies.get(host, self.default_body)
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n'
+                    b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: keep-alive\r\n\r\n' + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ssl.SSLError):
+            pass
+        except asyncio.CancelledError:
+            # 服务器停止时取消的连接，直接结束
+            pass
+        finally:
+            writer.close()
+
+    async def _start(self):
+        tls_context = make_certificate(self.tempdir.name) if self.https_endpoints else None
+        for i in range(self.endpoints):
+            roll = self.rng.random()
+            if roll < self.dead_share:
+                self.ports.append(unused_port())
+                continue
+            latency = self.slow_latency if roll < self.dead_share + self.slow_share else self.latency
+            context = tls_context if i < self.https_endpoints else None
+            server = await asyncio.start_server(
+                lambda r, w, latency=latency: self.handle(r, w, latency), '127.0.0.1', 0, ssl=context
+            )
+            self.servers.append(server)
+            port = server.sockets[0].getsockname()[1]
+            self.ports.append(port)
+            self.live_ports.append(port)
+
+    def start(self):
+        # 在后台线程的事件循环中运行，返回后端口已全部就绪
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start())
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    async def _stop(self):
+        # 关闭监听并取消仍在处理的连接
+        for server in self.servers:
+            server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.tempdir.cleanup()
+
+def usage():
+    # 返回(峰值内存MB, CPU秒数)
+    if resource is None:
+        times = os.times()
+        return None, times.user + times.system
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # Linux上ru_maxrss单位为KB，macOS上为字节
+    rss = usage.ru_maxrss / (1024 * 1024) if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+    return round(rss, 1), usage.ru_utime + usage.ru_stime
+
+def percentile(samples, q):
+    # 对排好序的样本做线性插值，得到精确的分位数
+    if not samples:
+        return 0
+    position = (len(samples) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(samples) - 1)
+    return round(samples[lower] + (samples[upper] - samples[lower]) * (position - lower), 2)
+
+def run_scenario(config):
+    # 在子进程中执行一次碰撞，输出一行JSON；每个引擎独立进程，内存和CPU互不干扰
+    from collision_runner import CollisionRunner
+    runner = CollisionRunner(
+        ['127.0.0.1'], config['ports'],
+        subdomains=config['hosts'],
+        engine=config['engine'],
+        concurrency=config['concurrency']
+    )
+    # 指标直方图的分桶太粗，无法对比提交之间的差异，这里另外保留首字节耗时的原始值
+    runner.metrics.keep_raw('first_byte')
+    _, cpu_before = usage()
+    started = time.monotonic()
+    hits = []
+    runner.run(on_result=hits.append)
+    elapsed = time.monotonic() - started
+    rss, cpu_after = usage()
+    snapshot = runner.metrics.snapshot()
+    first_byte_ms = sorted(seconds * 1000 for seconds in runner.metrics.raw['first_byte'])
+    return {
+        'engine': config['engine'],
+        'targets': runner.total,
+        'completed': runner.completed,
+        'hits': len(hits),
+        'elapsed': round(elapsed, 2),
+        'probes_per_sec': round(runner.completed / elapsed, 1) if elapsed > 0 else 0,
+        'p50_ms': percentile(first_byte_ms, 0.5),
+        'p99_ms': percentile(first_byte_ms, 0.99),
+        'peak_rss_mb': rss,
+        'cpu_sec': round(cpu_after - cpu_before, 2),
+        'errors': snapshot['errors'],
+    }
+
+def micro_benchmarks(number=5):
+    # 目标生成和标题提取的微基准，取多次中最快的一次
+    from collision_engine import iter_targets, extract_title
+    subdomains = [f"s{i}.example.com" for i in range(1000)]
+    main_domains = [f"m{i}.com" for i in range(100)]
+    prefixes = [f"p{i}" for i in range(100)]
+    endpoints = [(f"10.0.0.{i}", port) for i in range(10) for port in (80, 443)]
+
+    def generate():
+        for _ in iter_targets(subdomains, main_domains, prefixes, endpoints):
+            pass
+
+    count = sum(1 for _ in iter_targets(subdomains, main_domains, prefixes, endpoints))
+    small = make_body("标题", 2048)
+    large = b"<html><head><meta charset='utf-8'>" + b"x" * (64 * 1024) + b"<title>late</title>"
+    results = {}
+    best = min(timeit.repeat(generate, number=1, repeat=number))
+    results['iter_targets_per_sec'] = round(count / best)
+    for name, body in (('extract_title_small_per_sec', small), ('extract_title_64k_per_sec', large)):
+        best = min(timeit.repeat(lambda: extract_title(body, 'text/html'), number=1000, repeat=number))
+        results[name] = round(1000 / best)
+    return results
+
+def print_report(report):
+    server = report['server']
+    print(f"测试服务器: {server['endpoints']}个端点（存活{server['live']}个），{server['vhosts']}个虚拟主机，"
+          f"{server['targets']}个Host，每个存活端点预期命中{server['vhosts']}个")
+    print(f"{'引擎':<8}{'目标':>8}{'命中':>8}{'耗时s':>9}{'探测/s':>10}{'p50ms':>8}{'p99ms':>8}{'峰值内存MB':>12}{'CPU s':>8}")
+    for row in report['engines']:
+        print(f"{row['engine']:<8}{row['completed']:>8}{row['hits']:>8}{row['elapsed']:>9}{row['probes_per_sec']:>10}"
+              f"{row['p50_ms']:>8}{row['p99_ms']:>8}{str(row['peak_rss_mb']):>12}{row['cpu_sec']:>8}")
+        if row['errors']:
+            print(f"        错误: {row['errors']}")
+    for name, value in report.get('micro', {}).items():
+        print(f"{name}: {value}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Host碰撞工具性能基准")
+    parser.add_argument('--engines', default="thread,async", help="要测的引擎，逗号分隔（默认thread,async）")
+    parser.add_argument('--endpoints', type=int, default=20, help="测试服务器端点数（默认20）")
+    parser.add_argument('--https', type=int, default=5, help="其中HTTPS端点数（默认5，需要openssl）")
+    parser.add_argument('--vhosts', type=int, default=50, help="每个端点上的虚拟主机数（默认50）")
+    parser.add_argument('--misses', type=int, default=200, help="不存在的Host数，命中默认站点（默认200）")
+    parser.add_argument('--latency', type=float, default=5, help="响应延迟毫秒（默认5）")
+    parser.add_argument('--jitter', type=float, default=2, help="延迟随机抖动毫秒（默认2）")
+    parser.add_argument('--dead', type=float, default=0.1, help="不存活端点比例（默认0.1）")
+    parser.add_argument('--slow', type=float, default=0.1, help="慢速端点比例（默认0.1）")
+    parser.add_argument('--slow-latency', type=float, default=2000, help="慢速端点延迟毫秒（默认2000）")
+    parser.add_argument('--body-size', type=int, default=2048, help="普通页面大小（默认2048字节）")
+    parser.add_argument('--large-share', type=float, default=0.1, help="大页面虚拟主机比例（默认0.1）")
+    parser.add_argument('--large-size', type=int, default=1024 * 1024, help="大页面大小（默认1MB）")
+    parser.add_argument('-c', '--concurrency', type=int, default=200, help="碰撞并发数（默认200）")
+    parser.add_argument('--seed', type=int, default=1, help="随机种子，相同参数和种子得到相同的测试环境")
+    parser.add_argument('--no-micro', action='store_true', help="跳过微基准")
+    parser.add_argument('--json', metavar='FILE', help="报告同时以JSON写入该文件，便于对比")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)  # 内部使用：子进程执行单个引擎
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.scenario:
+        with open(args.scenario, 'r', encoding='utf-8') as f:
+            print(json.dumps(run_scenario(json.load(f))))
+        return 0
+
+    server = BenchServer(
+        vhosts=args.vhosts, endpoints=args.endpoints, https_endpoints=args.https,
+        latency=args.latency, jitter=args.jitter, dead_share=args.dead, slow_share=args.slow,
+        slow_latency=args.slow_latency, body_size=args.body_size,
+        large_share=args.large_share, large_size=args.large_size, seed=args.seed
+    )
+    server.start()
+    hosts = [vhost_name(i) for i in range(args.vhosts)] + [f"miss{i}.{BENCH_DOMAIN}" for i in range(args.misses)]
+    report = {
+        'server': {
+            'endpoints': len(server.ports),
+            'live': len(server.live_ports),
+            'vhosts': args.vhosts,
+            'targets': len(hosts),
+        },
+        'engines': [],
+    }
+    try:
+        for engine in args.engines.split(','):
+            with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8') as f:
+                json.dump({'engine': engine, 'ports': server.ports, 'hosts': hosts,
+                           'concurrency': args.concurrency}, f)
+            try:
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--scenario', f.name],
+                    check=True, stdout=subprocess.PIPE, text=True
+                ).stdout
+            finally:
+                os.remove(f.name)
+            report['engines'].append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        server.stop()
+
+    if not args.no_micro:
+        report['micro'] = micro_benchmarks()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
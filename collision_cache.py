@@ -0,0 +1,197 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from itertools import islice
+from collision_engine import CollisionResult, LENGTH_BUCKET, target_shard
+
+# 默认扫描缓存文件
+CACHE_FILE = "collision_cache.db"
+# 未命中结果的有效期（秒），期内的目标下次扫描直接跳过
+NEGATIVE_TTL = 30 * 24 * 3600
+# 命中结果的有效期（秒），默认每次都重新探测，以便发现消失和变化的结果
+RESULT_TTL = 0
+# 每次批量查询的目标数
+LOOKUP_BATCH = 500
+
+COLUMNS = ['domain', 'ip', 'port', 'scheme', 'fingerprint', 'result', 'checked_at', 'confirmed_at']
+
+# 与上次扫描相比的变化类型
+CHANGE_NAMES = {
+    'appeared': '新增',
+    'disappeared': '消失',
+    'changed': '变化',
+}
+
+def result_fingerprint(result):
+    # 结果里不保留正文，用状态码、长度分桶和标题判断响应是否变化
+    return json.dumps([result.status_code, result.content_length // LENGTH_BUCKET, result.title], ensure_ascii=False)
+
+# 持久化的扫描缓存：按(域名, IP, 端口, 协议)记录上次的结果，未命中也记录
+# 新一轮扫描只探测新增或过期的目标，并统计与上次相比新增、消失和变化的结果
+# checked_at是上次实际探测的时间，confirmed_at是命中结果上次被扫描确认（探测或沿用缓存）的时间
+class ScanCache:
+    def __init__(self, path, protocol_cache, ttl=NEGATIVE_TTL, result_ttl=RESULT_TTL, on_change=None, resume=False,
+                 batch_size=2000, flush_interval=2.0):
+        self.protocol_cache = protocol_cache
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self.on_change = on_change  # on_change(类型, 本次结果, 上次结果)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.confirmed = []  # 本次确认仍然有效、但没有重新写入的命中记录
+        self.last_flush = time.monotonic()
+        self.previous = {}  # 本次要重新探测、上次命中的(域名, IP, 端口) -> (协议, 指纹, 上次结果)
+        self.changes = Counter()
+        self.cached = 0
+        self.failed = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # 旧版本的缓存结构不同，直接重建
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(outcomes)")]
+        if columns and columns != COLUMNS:
+            with self.conn:
+                self.conn.execute("DROP TABLE outcomes")
+                self.conn.execute("DELETE FROM meta")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outcomes (domain TEXT, ip TEXT, port INTEGER, scheme TEXT, fingerprint TEXT, "
+            "result TEXT, checked_at REAL, confirmed_at REAL, PRIMARY KEY (domain, ip, port, scheme)) WITHOUT ROWID"
+        )
+        # 本轮扫描的开始时间，断点续扫时沿用，用来找出本轮没有再确认的命中结果
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'scan_started'").fetchone()
+        if resume and row:
+            self.scan_started = float(row[0])
+        else:
+            self.scan_started = time.time()
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('scan_started', ?)", (str(self.scan_started),))
+            # 过期的未命中记录不再有用，命中记录保留用于下次比较
+            self.conn.execute("DELETE FROM outcomes WHERE result IS NULL AND checked_at < ?", (time.time() - ttl,))
+
+    def scheme(self, ip, port):
+        # 端点当前确认的协议，未确认时取默认的第一个候选
+        return self.protocol_cache.candidates(ip, port)[0]
+
+    def pending_targets(self, targets, on_cached=None):
+        # 分批查询缓存，跳过未过期的目标，对它们调用on_cached(target, 缓存的结果)
+        # 查询不区分协议：预扫描前协议可能还没确认，每个(域名, IP, 端口)只保留最近一次的协议
+        iterator = iter(targets)
+        while True:
+            batch = list(islice(iterator, LOOKUP_BATCH))
+            if not batch:
+                return
+            rows = self._lookup([(target[0], target[1], target[2]) for target in batch])
+            now = time.time()
+            for target in batch:
+                triple = (target[0], target[1], target[2])
+                row = rows.get(triple)
+                if row is None:
+                    yield target
+                    continue
+                scheme, fingerprint, result, checked_at = row
+                if now - checked_at < (self.result_ttl if result else self.ttl):
+                    self.cached += 1
+                    if result:
+                        self._confirm(triple + (scheme,))
+                    if on_cached:
+                        on_cached(target, CollisionResult(**json.loads(result)) if result else None)
+                    continue
+                if result:
+                    with self.lock:
+                        self.previous[triple] = (scheme, fingerprint, result)
+                yield target
+
+    def _lookup(self, triples):
+        placeholders = ', '.join(['(?, ?, ?)'] * len(triples))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT domain, ip, port, scheme, fingerprint, result, checked_at FROM outcomes "
+                f"WHERE (domain, ip, port) IN (VALUES {placeholders}) ORDER BY checked_at",
+                [value for triple in triples for value in triple]
+            ).fetchall()
+        # 同一目标有多条记录时保留最近的一条
+        return {tuple(row[:3]): row[3:] for row in rows}
+
+    def _confirm(self, key):
+        with self.lock:
+            self.confirmed.append((time.time(),) + key)
+
+    def record(self, target, result, failed=False):
+        # 作为on_complete回调；探测失败的目标不写缓存，也不算作消失，下次重新探测
+        triple = (target[0], target[1], target[2])
+        with self.lock:
+            previous = self.previous.pop(triple, None)
+        if failed:
+            with self.lock:
+                self.failed += 1
+            if previous:
+                self._confirm(triple + (previous[0],))
+            return
+        scheme = result.url.split('://', 1)[0] if result else self.scheme(target[1], target[2])
+        fingerprint = result_fingerprint(result) if result else None
+        now = time.time()
+        with self.lock:
+            self.buffer.append(triple + (scheme, fingerprint,
+                                         json.dumps(result.to_dict(), ensure_ascii=False) if result else None, now, now))
+            if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+        if result and previous is None:
+            change = 'appeared'
+        elif result and previous[:2] != (scheme, fingerprint):
+            change = 'changed'
+        elif not result and previous is not None:
+            change = 'disappeared'
+        else:
+            return
+        self._change(change, result, CollisionResult(**json.loads(previous[2])) if previous else None)
+
+    def _change(self, change, result, previous):
+        with self.lock:
+            self.changes[change] += 1
+        if self.on_change:
+            self.on_change(change, result, previous)
+
+    def finish(self, endpoints, shard=None):
+        # 扫描正常跑完后调用：扫描范围内（同样的IP和端口）上次命中、本轮没有再确认的结果算作消失，
+        # 例如端口已关闭被预扫描排除，或者域名已从输入中删除；报告后删除这些记录
+        endpoints = set(endpoints)
+        with self.lock:
+            self._flush()
+            rows = self.conn.execute(
+                "SELECT domain, ip, port, scheme, result FROM outcomes WHERE result IS NOT NULL AND confirmed_at < ?",
+                (self.scan_started,)
+            ).fetchall()
+        gone = [row for row in rows if (row[1], row[2]) in endpoints
+                and (shard is None or target_shard(row[0], row[1], row[2], shard[1]) == shard[0])]
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM outcomes WHERE domain = ? AND ip = ? AND port = ? AND scheme = ?",
+                                  [row[:4] for row in gone])
+        for row in gone:
+            self._change('disappeared', None, CollisionResult(**json.loads(row[4])))
+
+    def summary(self):
+        return '，'.join(f"{name}{self.changes[change]}个" for change, name in CHANGE_NAMES.items())
+
+    def _flush(self):
+        # 同一目标换了协议时删除旧协议的记录，保证每个(域名, IP, 端口)只有一条
+        with self.conn:
+            self.conn.executemany("DELETE FROM outcomes WHERE domain = ? AND ip = ? AND port = ? AND scheme <> ?",
+                                  [row[:4] for row in self.buffer])
+            self.conn.executemany(f"INSERT OR REPLACE INTO outcomes VALUES ({', '.join('?' * len(COLUMNS))})",
+                                  self.buffer)
+            self.conn.executemany("UPDATE outcomes SET confirmed_at = ? WHERE domain = ? AND ip = ? AND port = ? AND scheme = ?",
+                                  self.confirmed)
+        self.buffer = []
+        self.confirmed = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+        self.conn.close()
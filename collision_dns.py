@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# aiodns只在指定DNS服务器时需要，未安装时使用系统解析
+try:
+    import aiodns
+except ImportError:
+    aiodns = None
+
+# 默认DNS缓存有效期（秒）
+DNS_CACHE_TTL = 24 * 3600
+# 解析方式：off不解析，annotate只在结果上标注，skip跳过已解析到该IP的目标，defer把这些目标放到最后
+DNS_MODES = ('off', 'annotate', 'skip', 'defer')
+
+# 解析结果缓存，指定路径时保存在SQLite中供下次使用，过期的记录重新解析
+class DnsCache:
+    def __init__(self, path=None, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.pending = []
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS dns (domain TEXT PRIMARY KEY, addresses TEXT, resolved_at REAL)")
+
+    def get(self, domain):
+        # 返回缓存的地址元组，没有或已过期返回None
+        if self.conn is None:
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT addresses, resolved_at FROM dns WHERE domain = ?", (domain,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return tuple(row[0].split(',')) if row[0] else ()
+
+    def put(self, domain, addresses):
+        if self.conn is None:
+            return
+        with self.lock:
+            self.pending.append((domain, ','.join(addresses), time.time()))
+            if len(self.pending) >= 1000:
+                self._flush()
+
+    def _flush(self):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO dns VALUES (?, ?, ?)", self.pending)
+        self.pending = []
+
+    def close(self):
+        if self.conn is not None:
+            with self.lock:
+                self._flush()
+            self.conn.close()
+            self.conn = None
+
+# 批量并发解析候选域名，只保留能解析的域名
+class DnsResolver:
+    def __init__(self, nameservers=None, concurrency=200, timeout=3, cache=None):
+        self.nameservers = list(nameservers or [])
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache = cache if cache is not None else DnsCache()
+        self.resolved = {}  # 域名 -> 地址元组
+
+    def resolve_all(self, domains, should_stop=None):
+        asyncio.run(self._resolve_all(domains, should_stop))
+        self.cache.close()
+        return self.resolved
+
+    def addresses(self, domain):
+        return self.resolved.get(domain, ())
+
+    async def _resolve_all(self, domains, should_stop):
+        if self.nameservers and aiodns is None:
+            print("未安装aiodns，忽略指定的DNS服务器，使用系统解析", file=sys.stderr)
+        if self.nameservers and aiodns is not None:
+            resolver = aiodns.DNSResolver(nameservers=self.nameservers, timeout=self.timeout)
+            lookup = lambda domain: self._query(resolver, domain)
+            executor = None
+        else:
+            # 系统解析是阻塞调用，放到独立线程池里并发执行
+            executor = ThreadPoolExecutor(max_workers=self.concurrency)
+            lookup = lambda domain: self._getaddrinfo(executor, domain)
+
+        seen = set()
+        iterator = iter(domains)
+
+        async def worker():
+            for domain in iterator:
+                if should_stop and should_stop():
+                    break
+                # 同一域名只解析一次，只记8字节哈希
+                key = hashlib.blake2b(domain.encode('utf-8'), digest_size=8).digest()
+                if key in seen:
+                    continue
+                seen.add(key)
+                addresses = self.cache.get(domain)
+                if addresses is None:
+                    try:
+                        addresses = await asyncio.wait_for(lookup(domain), self.timeout)
+                    except (OSError, asyncio.TimeoutError, UnicodeError):
+                        addresses = ()
+                    except Exception as e:
+                        if aiodns is None or not isinstance(e, aiodns.error.DNSError):
+                            raise
+                        addresses = ()
+                    self.cache.put(domain, addresses)
+                if addresses:
+                    self.resolved[domain] = addresses
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _getaddrinfo(self, executor, domain):
+        loop = asyncio.get_running_loop()
+        infos = await loop.run_in_executor(executor, socket.getaddrinfo, domain, None, 0, socket.SOCK_STREAM)
+        return tuple(sorted({info[4][0] for info in infos}))
+
+    async def _query(self, resolver, domain):
+        # aiodns 4起query已弃用，有query_dns时改用它：应答是pycares的记录，可能夹带CNAME，只取有地址的记录
+        addresses = set()
+        for record_type in ('A', 'AAAA'):
+            try:
+                if hasattr(resolver, 'query_dns'):
+                    result = await resolver.query_dns(domain, record_type)
+                    addresses.update(record.data.addr for record in result.answer if hasattr(record.data, 'addr'))
+                else:
+                    answers = await resolver.query(domain, record_type)
+                    addresses.update(answer.host for answer in answers)
+            except aiodns.error.DNSError:
+                continue
+        return tuple(sorted(addresses))
+
+def count_pointing(resolved, endpoints):
+    # 域名已解析到该IP的目标数，跳过这些目标时用来修正总数
+    ports_per_ip = Counter(ip for ip, port in endpoints)
+    return sum(ports_per_ip[address] for addresses in resolved.values() for address in addresses)
+
+def filter_pointing(make_targets, resolved, mode):
+    # make_targets每次调用重新生成目标；skip丢弃域名已解析到该IP的目标，defer放到最后再探测
+    def pointing(target):
+        return target[1] in resolved.get(target[0], ())
+
+    for target in make_targets():
+        if not pointing(target):
+            yield target
+    if mode == 'defer':
+        for target in make_targets():
+            if pointing(target):
+                yield target
@@ -0,0 +1,1454 @@
+import asyncio
+import errno
+import hashlib
+import heapq
+import html
+import itertools
+import json
+import random
+import re
+import secrets
+import sqlite3
+import ssl
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import aiohttp
+import urllib3
+
+# BeautifulSoup只作为标题提取的兜底，未安装时不影响使用
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+# 碰撞时直连IP，证书必然不匹配，不做校验也不告警
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# 每个端点获取基线时使用的随机Host数量
+BASELINE_SAMPLES = 3
+# 指纹中内容长度的分桶大小（字节）
+LENGTH_BUCKET = 512
+
+# 默认最多读取的正文字节数，超出部分直接丢弃
+MAX_BODY_SIZE = 64 * 1024
+# 线程引擎分块读取正文的大小
+READ_CHUNK = 16 * 1024
+# 看门狗检查在途探测的间隔（秒）
+WATCHDOG_INTERVAL = 1.0
+# 线程引擎等待限速令牌时检查停止标志的间隔（秒）
+STOP_POLL_INTERVAL = 0.2
+# 每个端点并发窗口的初始值和上限
+INITIAL_WINDOW = 8
+MAX_WINDOW = 256
+# 窗口降到最小后仍连续失败这么多次的端点暂时熔断，冷却期内的探测直接失败，不再占用窗口等超时
+TRIP_FAILURES = 8
+# 窗口已满的端点在内存中最多积压的目标数，超出的暂存到临时数据库
+BACKLOG_PER_ENDPOINT = 64
+# 内存中积压的目标总数上限，达到后暂停读取新目标，等端点腾出窗口
+MAX_BACKLOG = 10000
+# 线程引擎最多同时保留的连接池数，按最近使用淘汰
+MAX_POOLS = 4096
+# 证书匹配后优先探测的候选域名数上限，超出的按原顺序探测
+MAX_CERT_PRIORITY = 10000
+
+TITLE_RE = re.compile(rb'<title[^>]*>(.*?)</title', re.IGNORECASE | re.DOTALL)
+CHARSET_RE = re.compile(rb'charset\s*=\s*["\']?([\w-]+)', re.IGNORECASE)
+
+# 默认请求头
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+RESULT_FIELDS = ('url', 'domain', 'ip', 'port', 'title', 'status_code', 'content_length', 'resolved')
+
+class CollisionResult:
+    # 结果可能很多，用__slots__省去每个对象的__dict__
+    __slots__ = RESULT_FIELDS
+
+    def __init__(self, url, domain, ip, port, title, status_code, content_length, resolved=''):
+        self.url = url
+        self.domain = domain
+        self.ip = ip
+        self.port = port
+        self.title = title
+        self.status_code = status_code
+        self.content_length = content_length
+        self.resolved = resolved  # 域名公网解析到的地址，逗号分隔
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in RESULT_FIELDS}
+
+def get_protocols(port):
+    # 根据端口确定协议尝试顺序
+    if port == 443:
+        return ['https']  # 443端口只探测HTTPS
+    elif port == 80:
+        return ['http']   # 80端口只探测HTTP
+    # 对于其他端口，尝试两种协议
+    return ['http', 'https']
+
+# 每个(ip, port)确认可用的协议，非标准端口不必对每个域名都把http/https各试一遍
+class ProtocolCache:
+    def __init__(self):
+        self.protocols = {}
+        self.lock = threading.Lock()
+
+    def candidates(self, ip, port):
+        # 已确认的协议排在最前，其余协议作为失效后的回退
+        protocols = get_protocols(port)
+        cached = self.protocols.get((ip, port))
+        if cached in protocols:
+            return [cached] + [p for p in protocols if p != cached]
+        return protocols
+
+    def confirm(self, ip, port, protocol):
+        self.protocols[(ip, port)] = protocol
+
+    def invalidate(self, ip, port, protocol):
+        # 只有缓存的正是失败的协议时才清除
+        with self.lock:
+            if self.protocols.get((ip, port)) == protocol:
+                del self.protocols[(ip, port)]
+
+def build_url(protocol, host, port):
+    # IPv6地址需要加方括号
+    if ':' in host:
+        host = f"[{host}]"
+    return f"{protocol}://{host}:{port}"
+
+def detect_charset(content_type, content):
+    # 优先取响应头中的编码，其次取页面meta中声明的编码
+    match = CHARSET_RE.search((content_type or '').encode('latin-1', 'ignore')) or CHARSET_RE.search(content[:2048])
+    if match:
+        return match.group(1).decode('ascii')
+    return None
+
+def decode_text(data, charset):
+    if charset:
+        try:
+            return data.decode(charset)
+        except (LookupError, UnicodeDecodeError):
+            pass
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('gb18030', errors='replace')
+
+def extract_title(content, content_type=''):
+    # 只用正则找到第一个<title>，匹配到</title即停止，不解析整个文档
+    match = TITLE_RE.search(content)
+    if not match:
+        return None
+    title = decode_text(match.group(1), detect_charset(content_type, content))
+    return ' '.join(html.unescape(title).split())
+
+def parse_title(status_code, content_type, content, fallback=False):
+    # 只有200的HTML页面才提取标题
+    if status_code != 200 or 'text/html' not in (content_type or ''):
+        return ""
+    title = extract_title(content, content_type)
+    if title is not None:
+        return title
+    
+    # 正则没找到时，可选用BeautifulSoup完整解析兜底
+    if fallback and BeautifulSoup is not None:
+        try:
+            soup = BeautifulSoup(content, 'html.parser')
+            title_tag = soup.find('title')
+            if title_tag:
+                return title_tag.get_text().strip()
+        except Exception:
+            pass
+    return ""
+
+def get_content_length(header_value, counted, truncated):
+    # 正文完整读取时用实际字节数，被截断时优先用响应头中的长度
+    if truncated:
+        try:
+            return int(header_value)
+        except (TypeError, ValueError):
+            pass
+    return counted
+
+def make_fingerprint(status_code, content_length, title, content):
+    # 紧凑指纹：状态码、长度分桶、标题、正文哈希
+    body_hash = hashlib.blake2b(content, digest_size=8).digest()
+    return (status_code, content_length // LENGTH_BUCKET, title, body_hash)
+
+def random_hosts(count=BASELINE_SAMPLES):
+    # 生成不存在的随机域名，用于获取端点的默认站点响应
+    return [f"{secrets.token_hex(6)}.{secrets.token_hex(4)}.com" for _ in range(count)]
+
+# 每个(ip, port)用随机Host请求得到的默认站点指纹，与之相同的响应不算碰撞结果
+class BaselineCache:
+    def __init__(self):
+        self.fingerprints = {}
+
+    def add(self, ip, port, fingerprint):
+        self.fingerprints.setdefault((ip, port), set()).add(fingerprint)
+
+    def matches(self, ip, port, fingerprint):
+        # 状态码相同的前提下，正文哈希相同或长度分桶、标题都相同，即视为默认站点
+        # 状态码不同一律保留：空正文的302跳转和404默认页正文哈希相同，但跳转正是要找的结果
+        for baseline in self.fingerprints.get((ip, port), ()):
+            if fingerprint[0] == baseline[0] and (fingerprint[3] == baseline[3] or fingerprint[1:3] == baseline[1:3]):
+                return True
+        return False
+
+def build_result(url, domain, ip, port, status_code, content_type, content, content_length,
+                 baseline_cache=None, title_fallback=False):
+    # 提取标题并与基线比对，命中基线的响应不创建结果对象
+    title = parse_title(status_code, content_type, content, title_fallback)
+    if baseline_cache is not None:
+        fingerprint = make_fingerprint(status_code, content_length, title, content)
+        if baseline_cache.matches(ip, port, fingerprint):
+            return None
+    return CollisionResult(
+        url=url,
+        domain=domain,
+        ip=ip,
+        port=port,
+        title=title,
+        status_code=status_code,
+        content_length=content_length
+    )
+
+# 所有协议都没拿到响应（超时、连接失败、被重置等），与正常的未命中区分开，可交给重试车道
+class ProbeError(Exception):
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+# 端点处于熔断期，没有发出请求
+class EndpointDown(Exception):
+    def __init__(self, ip, port):
+        super().__init__(f"端点{ip}:{port}连续失败，暂停探测")
+
+# 扫描已停止，请求没有发出
+class ProbeStopped(Exception):
+    pass
+
+# 已发出的请求超过硬性期限仍未完成
+class ProbeDeadline(Exception):
+    def __init__(self, elapsed):
+        super().__init__(f"超过期限，已耗时{elapsed:.0f}秒")
+        self.elapsed = elapsed
+
+# 全局令牌桶，限制每秒发出的请求数
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # 预订一个令牌，返回需要等待的秒数；令牌可以透支，后来者顺延等待
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+# 每个(ip, port)一个AIMD并发窗口：第一次失败前每次成功加1（慢启动），之后每次成功加1/窗口，超时或连接被重置时减半
+# 探测派发时用try_acquire占用窗口，探测结束时release，不会阻塞调用方；每个请求的结果通过feedback调整窗口
+# 窗口降到最小后仍连续失败的端点熔断cooldown秒，期间的请求直接失败，冷却后放过一个请求试探是否恢复
+class AdaptiveLimiter:
+    def __init__(self, initial=INITIAL_WINDOW, minimum=1, maximum=MAX_WINDOW, cooldown=10):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.windows = {}
+        self.inflight = {}
+        self.congested = set()
+        self.failures = {}
+        self.tripped = {}  # (ip, port) -> 熔断开始或上次试探的时间
+        self.lock = threading.Lock()
+
+    def window(self, key):
+        return self.windows.get(key, self.initial)
+
+    def try_acquire(self, key):
+        with self.lock:
+            inflight = self.inflight.get(key, 0)
+            if inflight >= int(self.window(key)):
+                return False
+            self.inflight[key] = inflight + 1
+            return True
+
+    def release(self, key):
+        with self.lock:
+            self.inflight[key] -= 1
+            if not self.inflight[key]:
+                del self.inflight[key]
+
+    def is_down(self, key):
+        # 端点是否处于熔断期；冷却期过后放过一个请求，并重新开始计时
+        with self.lock:
+            tripped = self.tripped.get(key)
+            if tripped is None:
+                return False
+            if time.monotonic() - tripped < self.cooldown:
+                return True
+            self.tripped[key] = time.monotonic()
+            return False
+
+    def feedback(self, key, outcome):
+        # outcome: True成功，False超时/重置，None与端点负载无关的失败（窗口不变）
+        if outcome is None:
+            return
+        with self.lock:
+            window = self.window(key)
+            if outcome:
+                window = min(self.maximum, window + (1 / window if key in self.congested else 1))
+                self.failures.pop(key, None)
+                self.tripped.pop(key, None)
+            else:
+                window = max(self.minimum, window / 2)
+                self.congested.add(key)
+                self.failures[key] = self.failures.get(key, 0) + 1
+                # 熔断期间试探失败时重新开始冷却
+                if key in self.tripped or (window <= self.minimum and self.failures[key] >= TRIP_FAILURES):
+                    self.tripped[key] = time.monotonic()
+            self.windows[key] = window
+
+# 按端点窗口派发目标：窗口已满的端点把目标放进该端点的积压队列，接着取下一个目标，
+# 只把目标派发给窗口有空位的端点，慢端点不会占住所有worker
+# 单个端点积压过多时暂存到临时数据库，队列取空后再分批读回，内存不随目标总数增长
+class TargetScheduler:
+    def __init__(self, targets, limiter):
+        self.iterator = iter(targets)
+        self.limiter = limiter
+        self.backlog = {}  # (ip, port) -> deque
+        self.backlogged = 0
+        self.ready = deque()  # 有目标积压且可能有空位的端点
+        self.spilled = {}  # (ip, port) -> 暂存在数据库中的目标数
+        self.spill = None
+
+    def next(self):
+        # 返回一个已占用窗口、可以立即发出的目标；暂时没有可派发的目标时返回None
+        if self.limiter is None:
+            return next(self.iterator, None)
+        while self.ready:
+            key = self.ready.popleft()
+            if key in self.backlog and self.limiter.try_acquire(key):
+                target = self._take(key)
+                if key in self.backlog:
+                    self.ready.append(key)
+                return target
+        while self.backlogged < MAX_BACKLOG:
+            target = next(self.iterator, None)
+            if target is None:
+                return None
+            key = (target[1], target[2])
+            if key not in self.backlog and self.limiter.try_acquire(key):
+                return target
+            queue = self.backlog.setdefault(key, deque())
+            if len(queue) < BACKLOG_PER_ENDPOINT:
+                queue.append(target)
+                self.backlogged += 1
+            else:
+                self._spill(key, target)
+        return None
+
+    def release(self, target):
+        # 探测结束，归还窗口；该端点还有积压时下次优先派发
+        key = (target[1], target[2])
+        if self.limiter is None:
+            return
+        self.limiter.release(key)
+        if key in self.backlog:
+            self.ready.append(key)
+
+    def _take(self, key):
+        queue = self.backlog[key]
+        target = queue.popleft()
+        self.backlogged -= 1
+        if not queue and self.spilled.get(key):
+            self._refill(key, queue)
+        if not queue:
+            del self.backlog[key]
+        return target
+
+    def _spill(self, key, target):
+        if self.spill is None:
+            # 空文件名是sqlite的临时数据库，关闭连接时自动删除
+            self.spill = sqlite3.connect('')
+            self.spill.execute("CREATE TABLE targets (ip TEXT, port INTEGER, target TEXT)")
+            self.spill.execute("CREATE INDEX targets_endpoint ON targets (ip, port)")
+        self.spill.execute("INSERT INTO targets VALUES (?, ?, ?)", key + (json.dumps(target),))
+        self.spilled[key] = self.spilled.get(key, 0) + 1
+
+    def _refill(self, key, queue):
+        rows = self.spill.execute("SELECT rowid, target FROM targets WHERE ip = ? AND port = ? ORDER BY rowid LIMIT ?",
+                                  key + (BACKLOG_PER_ENDPOINT,)).fetchall()
+        self.spill.executemany("DELETE FROM targets WHERE rowid = ?", [(row[0],) for row in rows])
+        queue.extend(tuple(json.loads(row[1])) for row in rows)
+        self.backlogged += len(rows)
+        self.spilled[key] -= len(rows)
+        if not self.spilled[key]:
+            del self.spilled[key]
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+def report_stuck(target, elapsed):
+    print(f"探测超时已放弃: {target[0]} -> {target[1]}:{target[2]}，已耗时{elapsed:.0f}秒", file=sys.stderr)
+
+def classify_error(error):
+    # 把两种引擎的异常归到几个类别，供指标按类别统计
+    if isinstance(error, urllib3.exceptions.MaxRetryError) and error.reason is not None:
+        error = error.reason
+    if isinstance(error, (ssl.SSLError, urllib3.exceptions.SSLError, aiohttp.ClientSSLError)):
+        return 'tls'
+    # urllib3的NewConnectionError继承自超时异常，要先判断
+    if isinstance(error, (urllib3.exceptions.NewConnectionError, aiohttp.ClientConnectorError, ConnectionRefusedError)):
+        return 'connect'
+    if isinstance(error, (asyncio.TimeoutError, urllib3.exceptions.TimeoutError)):
+        return 'timeout'
+    if isinstance(error, (urllib3.exceptions.ProtocolError, aiohttp.ServerDisconnectedError,
+                          aiohttp.ClientPayloadError, ConnectionResetError)):
+        return 'reset'
+    return 'other'
+
+def wrong_protocol(error):
+    # TLS握手失败、响应不是HTTP、连接被断开或重置，说明端点可能不是这个协议，值得换协议再试
+    # 超时和连接被拒绝换协议也一样，不回退
+    if isinstance(error, urllib3.exceptions.MaxRetryError) and error.reason is not None:
+        error = error.reason
+    if isinstance(error, (ssl.SSLError, urllib3.exceptions.SSLError, urllib3.exceptions.ProtocolError,
+                          aiohttp.ClientSSLError, aiohttp.ServerDisconnectedError, aiohttp.ClientResponseError,
+                          ConnectionResetError)):
+        return True
+    return isinstance(error, aiohttp.ClientOSError) and error.errno == errno.ECONNRESET
+
+def timed_connection(base, metrics, tls):
+    # 给urllib3连接类加上计时：_new_conn只建TCP连接，connect中剩下的时间是TLS握手
+    class TimedConnection(base):
+        def _new_conn(self):
+            started = time.monotonic()
+            conn = super()._new_conn()
+            self.tcp_time = time.monotonic() - started
+            metrics.observe('connect', self.tcp_time)
+            return conn
+
+        def connect(self):
+            started = time.monotonic()
+            self.tcp_time = 0
+            super().connect()
+            if tls:
+                metrics.observe('tls', time.monotonic() - started - self.tcp_time)
+
+    return TimedConnection
+
+def make_endpoints(ips, ports):
+    # IP和端口组合成(ip, port)列表
+    return [(ip, port) for ip in ips for port in ports]
+
+def iter_domains(subdomains, main_domains, prefixes):
+    # 全部候选域名：子域名列表，以及前缀和主域名的组合
+    yield from subdomains
+    for main_domain in main_domains:
+        for prefix in prefixes:
+            yield f"{prefix}.{main_domain}"
+
+def iter_targets(subdomains, main_domains, prefixes, endpoints):
+    # 惰性生成目标，不在内存中展开整个笛卡尔积
+    for subdomain in iter_domains(subdomains, main_domains, prefixes):
+        for ip, port in endpoints:
+            yield (subdomain, ip, port)
+
+def count_targets(subdomains, main_domains, prefixes, endpoints):
+    # 直接计算目标总数，供进度条使用
+    return (len(subdomains) + len(main_domains) * len(prefixes)) * len(endpoints)
+
+def target_shard(domain, ip, port, count):
+    # 按目标内容哈希分片，与生成顺序和预扫描结果无关，不同机器上结果一致
+    return zlib.crc32(f"{domain} {ip} {port}".encode('utf-8')) % count
+
+def shard_targets(targets, index, count):
+    # 只保留属于第index个分片（共count个）的目标
+    for target in targets:
+        if target_shard(target[0], target[1], target[2], count) == index:
+            yield target
+
+def parse_shard(value):
+    # 解析"i/n"格式的分片参数，i从0开始
+    index, count = (int(part) for part in value.split('/'))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("分片格式为i/n，且0 <= i < n")
+    return index, count
+
+async def probe_endpoint(ip, port, timeout=3):
+    # 只做TCP连接，能连上即认为端口存活
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+def insecure_context():
+    # 碰撞时不校验证书，只需要完成握手
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+# 不校验证书、按端点恢复TLS会话的SSLContext：记住该端点最近一次握手得到的会话，下次握手时带上
+# 换了SNI的连接也带上会话，由服务器决定是否接受，不接受时照常完整握手
+class ResumingContext(ssl.SSLContext):
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        return super().__new__(cls, protocol)
+
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        self.check_hostname = False
+        self.verify_mode = ssl.CERT_NONE
+        self.session = None
+        self.last = None  # 最近一次握手的连接，TLS 1.3的会话票据在握手之后才到达，下次握手时再取
+
+    def wrap_socket(self, sock, *args, session=None, **kwargs):
+        self.last = super().wrap_socket(sock, *args, session=session or self._session(), **kwargs)
+        return self.last
+
+    def wrap_bio(self, incoming, outgoing, *args, session=None, **kwargs):
+        self.last = super().wrap_bio(incoming, outgoing, *args, session=session or self._session(), **kwargs)
+        return self.last
+
+    def remember(self, ssl_object):
+        # 只记下能恢复的会话（带票据或会话ID），还没收到票据的会话不覆盖之前的
+        session = getattr(ssl_object, 'session', None)
+        if session is not None and (session.has_ticket or session.id):
+            self.session = session
+
+    def _session(self):
+        self.remember(self.last)
+        return self.session
+
+async def probe_tls(ip, port, timeout=3):
+    # 尝试TLS握手，成功说明端点是https
+    context = insecure_context()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port, ssl=context), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+def scan_live_endpoints(endpoints, concurrency=1000, timeout=3, should_stop=None, protocol_cache=None):
+    # 每个(ip, port)只探测一次，返回存活的端点，顺序与输入一致
+    # 传入protocol_cache时，顺便用TLS握手确定非标准端口的协议
+    return asyncio.run(_scan_live_endpoints(endpoints, concurrency, timeout, should_stop, protocol_cache))
+
+async def _scan_live_endpoints(endpoints, concurrency, timeout, should_stop, protocol_cache):
+    alive = set()
+    iterator = iter(endpoints)
+
+    async def worker():
+        for ip, port in iterator:
+            if should_stop and should_stop():
+                break
+            if await probe_endpoint(ip, port, timeout):
+                alive.add((ip, port))
+                if protocol_cache is not None and len(get_protocols(port)) > 1:
+                    protocol = 'https' if await probe_tls(ip, port, timeout) else 'http'
+                    protocol_cache.confirm(ip, port, protocol)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(endpoints)))))
+    return [endpoint for endpoint in endpoints if endpoint in alive]
+
+# 证书扩展中subjectAltName和subject中commonName的OID编码
+SAN_OID = b'\x06\x03\x55\x1d\x11'
+CN_OID = b'\x06\x03\x55\x04\x03'
+
+def _der_length(data, pos):
+    # 解析DER长度字段，返回(长度, 内容起始位置)
+    length = data[pos]
+    if length < 0x80:
+        return length, pos + 1
+    size = length & 0x7f
+    return int.from_bytes(data[pos + 1:pos + 1 + size], 'big'), pos + 1 + size
+
+def _is_hostname(name):
+    return '.' in name and ' ' not in name and '@' not in name
+
+def parse_certificate_names(der):
+    # 从DER证书中取出subject的CN和SAN里的DNS名称，只做够用的最小解析，不依赖第三方库
+    names = []
+    try:
+        # issuer在subject之前，最后一个CN才是subject的
+        pos = der.rfind(CN_OID)
+        if pos != -1:
+            length, start = _der_length(der, pos + len(CN_OID) + 1)
+            names.append(der[start:start + length].decode('utf-8', errors='ignore'))
+        pos = der.find(SAN_OID)
+        if pos != -1:
+            pos += len(SAN_OID)
+            if der[pos] == 0x01:  # 可选的critical标记
+                pos += 3
+            _, pos = _der_length(der, pos + 1)  # OCTET STRING
+            length, pos = _der_length(der, pos + 1)  # SEQUENCE OF GeneralName
+            end = pos + length
+            while pos < end:
+                tag = der[pos]
+                length, start = _der_length(der, pos + 1)
+                if tag == 0x82:  # dNSName
+                    names.append(der[start:start + length].decode('ascii', errors='ignore'))
+                pos = start + length
+    except IndexError:
+        pass
+    unique = []
+    for name in names:
+        name = name.strip().lower().rstrip('.')
+        if _is_hostname(name) and name not in unique:
+            unique.append(name)
+    return unique
+
+async def fetch_certificate(ip, port, timeout=3):
+    # 不带SNI握手一次，取服务器默认证书，返回DER编码，失败返回None
+    context = insecure_context()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port, ssl=context), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    der = writer.get_extra_info('ssl_object').getpeercert(binary_form=True)
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return der
+
+# 每个端点证书上的域名，用于把可能命中的目标排到前面
+class CertificateNames:
+    def __init__(self, names=None):
+        self.names = {}  # (ip, port) -> [证书域名]
+        self.exact = {}  # 域名 -> {(ip, port)}
+        self.wildcard = {}  # 通配符的父域名 -> {(ip, port)}
+        for (ip, port), endpoint_names in (names or {}).items():
+            self.add(ip, port, endpoint_names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, ip, port, names):
+        self.names[(ip, port)] = list(names)
+        for name in names:
+            if name.startswith('*.'):
+                self.wildcard.setdefault(name[2:], set()).add((ip, port))
+            else:
+                self.exact.setdefault(name, set()).add((ip, port))
+
+    def match(self, domain):
+        # 返回证书名与domain匹配的端点，通配符只匹配一级
+        endpoints = self.exact.get(domain, set())
+        parent = domain.split('.', 1)[1] if '.' in domain else ''
+        if parent in self.wildcard:
+            endpoints = endpoints | self.wildcard[parent]
+        return endpoints
+
+    def to_json(self):
+        return [[ip, port, names] for (ip, port), names in self.names.items()]
+
+    @classmethod
+    def from_json(cls, items):
+        return cls({(ip, port): names for ip, port, names in items})
+
+def harvest_certificates(endpoints, protocol_cache=None, concurrency=1000, timeout=3, should_stop=None):
+    # 对每个https端点握手一次，收集证书上的域名
+    return asyncio.run(_harvest_certificates(endpoints, protocol_cache, concurrency, timeout, should_stop))
+
+async def _harvest_certificates(endpoints, protocol_cache, concurrency, timeout, should_stop):
+    certificates = CertificateNames()
+    candidates = []
+    for ip, port in endpoints:
+        protocol = protocol_cache.protocols.get((ip, port)) if protocol_cache is not None else None
+        if protocol == 'https' or (protocol is None and 'https' in get_protocols(port)):
+            candidates.append((ip, port))
+    iterator = iter(candidates)
+
+    async def worker():
+        for ip, port in iterator:
+            if should_stop and should_stop():
+                break
+            der = await fetch_certificate(ip, port, timeout)
+            if der:
+                # 能完成TLS握手，顺便确认协议
+                if protocol_cache is not None:
+                    protocol_cache.confirm(ip, port, 'https')
+                names = parse_certificate_names(der)
+                if names:
+                    certificates.add(ip, port, names)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(candidates)))))
+    return certificates
+
+def plan_certificate_targets(certificates, subdomains, main_domains, prefixes, endpoints, add_names=False,
+                             limit=MAX_CERT_PRIORITY):
+    # 遍历一次候选域名，只记下证书名匹配的前limit个域名，目标在遍历时再展开，内存不随目标数增长
+    # 返回(优先域名, 匹配的目标数, 证书新域名目标)；add_names时加上证书里有但不在候选中的域名
+    live = set(endpoints)
+    names = {name for endpoint, endpoint_names in certificates.names.items() if endpoint in live
+             for name in endpoint_names if not name.startswith('*.')}
+    priority = []
+    matched = 0
+    for domain in iter_domains(subdomains, main_domains, prefixes):
+        names.discard(domain)
+        matches = certificates.match(domain) & live
+        if not matches:
+            continue
+        matched += len(matches)
+        if len(priority) < limit:
+            priority.append(domain)
+    extra = []
+    if add_names:
+        for (ip, port), endpoint_names in certificates.names.items():
+            if (ip, port) in live:
+                extra.extend((name, ip, port) for name in endpoint_names if name in names)
+    return priority, matched, extra
+
+def prioritized_targets(certificates, priority, extra, subdomains, main_domains, prefixes, endpoints):
+    # 先探测优先域名中证书匹配的目标和证书新域名，其余目标按原顺序跟在后面
+    # 已探测的目标按域名标记，优先域名只跳过它证书匹配的端点
+    for domain in priority:
+        matches = certificates.match(domain)
+        for ip, port in endpoints:
+            if (ip, port) in matches:
+                yield (domain, ip, port)
+    yield from extra
+    priority = set(priority)
+    for domain in iter_domains(subdomains, main_domains, prefixes):
+        matches = certificates.match(domain) if domain in priority else ()
+        for ip, port in endpoints:
+            if (ip, port) not in matches:
+                yield (domain, ip, port)
+
+# 基于线程池的碰撞引擎，直连IP并按(协议, IP, 端口)复用长连接
+class ThreadCollisionEngine:
+    def __init__(self, concurrency=50, timeout=10, protocol_cache=None, baseline_cache=None,
+                 max_body=MAX_BODY_SIZE, title_fallback=False, probe_deadline=None,
+                 rate_limit=0, adaptive=True, max_window=MAX_WINDOW, metrics=None, rate_limiter=None,
+                 max_pools=MAX_POOLS):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.metrics = metrics
+        self.tls_contexts = {}  # (ip, port) -> ResumingContext
+        if metrics:
+            self.connection_classes = {
+                'http': timed_connection(urllib3.connection.HTTPConnection, metrics, False),
+                'https': timed_connection(urllib3.connection.HTTPSConnection, metrics, True),
+            }
+        # 单个请求的硬性期限，超过即放弃，不再阻塞结果收集；从请求真正发出时开始计时，限速的等待不计入
+        self.probe_deadline = probe_deadline or timeout * 3
+        self.local = threading.local()
+        # 可以传入其他引擎的令牌桶共用同一个限速
+        self.rate_limiter = rate_limiter or (TokenBucket(rate_limit) if rate_limit else None)
+        self.limiter = AdaptiveLimiter(maximum=max_window, cooldown=timeout) if adaptive else None
+        self.max_body = max_body
+        self.title_fallback = title_fallback
+        self.protocol_cache = protocol_cache if protocol_cache is not None else ProtocolCache()
+        self.baseline_cache = baseline_cache
+        self.pools = OrderedDict()
+        self.pools_lock = threading.Lock()
+        self.max_pools = max_pools  # 每个池至少保留一个空闲连接，池数也受打开文件数限制
+        self.should_stop = None  # 由run和fetch_baselines设置，停止后还没发出的请求直接放弃
+
+    def run(self, targets, on_result=None, should_stop=None, on_complete=None, on_stuck=report_stuck, on_failed=None):
+        # targets中每项前三个元素为(domain, ip, port)，其余字段原样透传给on_complete
+        # 传入on_failed时，探测失败或超过期限的目标交给on_failed(target, error)，不再调用on_complete
+        # 在途任务数不超过线程数，只派发给窗口有空位的端点，内存不随目标总数增长；按完成顺序收集结果
+        self.should_stop = should_stop
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = {}  # future -> (target, [当前请求的发出时间])
+        scheduler = TargetScheduler(targets, self.limiter)
+        last_check = time.monotonic()
+        try:
+            while True:
+                if should_stop and should_stop():
+                    break
+                while len(pending) < self.concurrency:
+                    target = scheduler.next()
+                    if target is None:
+                        break
+                    clock = [None]
+                    future = executor.submit(self._watched_probe, clock, target[0], target[1], target[2])
+                    pending[future] = (target, clock)
+                if not pending:
+                    break
+                
+                # 带超时等待，保证能及时响应停止和看门狗检查
+                done, _ = wait(pending, timeout=WATCHDOG_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    target, _ = pending.pop(future)
+                    scheduler.release(target)
+                    self._collect(future, target, on_result, on_complete, on_failed)
+                
+                if time.monotonic() - last_check >= WATCHDOG_INTERVAL:
+                    last_check = time.monotonic()
+                    self._abandon_stuck(pending, scheduler, on_complete, on_stuck, on_failed)
+        finally:
+            # 不等待仍在运行的线程，排队中的任务直接取消
+            executor.shutdown(wait=False, cancel_futures=True)
+            scheduler.close()
+            self.close()
+
+    def _watched_probe(self, clock, domain, ip, port):
+        # clock[0]由request在请求发出时写入，排队等待期间为None，看门狗只对已发出的请求计时
+        self.local.clock = clock
+        try:
+            return self.probe(domain, ip, port)
+        finally:
+            self.local.clock = None
+
+    def _abandon_stuck(self, pending, scheduler, on_complete, on_stuck, on_failed):
+        # 看门狗：请求发出后超过期限的探测视为失败，从在途集合中移除并归还窗口，线程随socket超时自行结束
+        now = time.monotonic()
+        for future, (target, clock) in list(pending.items()):
+            if clock[0] is None:
+                continue
+            elapsed = now - clock[0]
+            if elapsed > self.probe_deadline:
+                del pending[future]
+                future.cancel()
+                scheduler.release(target)
+                if on_stuck:
+                    on_stuck(target, elapsed)
+                if on_failed:
+                    on_failed(target, TimeoutError(f"超过期限{self.probe_deadline}秒"))
+                elif on_complete:
+                    on_complete(target, None)
+
+    def fetch_baselines(self, endpoints, should_stop=None):
+        # 对每个端点用随机Host请求，记录默认站点指纹
+        if self.baseline_cache is None:
+            self.baseline_cache = BaselineCache()
+        self.should_stop = should_stop
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        futures = [executor.submit(self.check_baseline, ip, port) for ip, port in endpoints]
+        try:
+            while futures:
+                if should_stop and should_stop():
+                    break
+                _, not_done = wait(futures, timeout=WATCHDOG_INTERVAL)
+                futures = list(not_done)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _collect(self, future, target, on_result, on_complete, on_failed=None):
+        result = None
+        try:
+            result = future.result()
+            if result and on_result:
+                on_result(result)
+        except ProbeStopped:
+            return
+        except ProbeError as e:
+            if on_failed:
+                on_failed(target, e.error)
+                return
+        except Exception as e:
+            print(f"检查目标时出错: {e}", file=sys.stderr)
+        if on_complete:
+            on_complete(target, result)
+
+    def get_pool(self, protocol, ip, port, domain):
+        # http每个(IP, 端口)一个连接池，所有候选域名共用；https按SNI分池，保证SNI与Host一致
+        # 每个域名在一个端点上通常只探测一次，https池只保留一个连接；同一端点的https池共用一个SSLContext，
+        # 新连接靠恢复TLS会话省掉完整握手；目标按域名依次展开，用完的池按最近使用淘汰
+        sni = domain if protocol == 'https' else None
+        key = (protocol, ip, port, sni)
+        with self.pools_lock:
+            pool = self.pools.get(key)
+            if pool is not None:
+                self.pools.move_to_end(key)
+                return pool
+        # 建池不持有锁，并发建出的重复池直接丢弃
+        timeout = urllib3.Timeout(total=self.timeout)
+        if protocol == 'https':
+            pool = urllib3.HTTPSConnectionPool(
+                ip, port, maxsize=1, timeout=timeout, ssl_context=self.tls_context(ip, port),
+                cert_reqs='CERT_NONE', assert_hostname=False, server_hostname=domain
+            )
+        else:
+            pool = urllib3.HTTPConnectionPool(ip, port, maxsize=self.concurrency, timeout=timeout)
+        if self.metrics:
+            pool.ConnectionCls = self.connection_classes[protocol]
+        with self.pools_lock:
+            existing = self.pools.get(key)
+            if existing is not None:
+                self.pools.move_to_end(key)
+                return existing
+            self.pools[key] = pool
+            while len(self.pools) > self.max_pools:
+                # 被淘汰的池里正在使用的连接归还时会直接关闭
+                _, evicted = self.pools.popitem(last=False)
+                evicted.close()
+            return pool
+
+    def tls_context(self, ip, port):
+        context = self.tls_contexts.get((ip, port))
+        if context is None:
+            context = self.tls_contexts.setdefault((ip, port), ResumingContext())
+        return context
+
+    def close(self):
+        with self.pools_lock:
+            for pool in self.pools.values():
+                pool.close()
+            self.pools.clear()
+
+    def request(self, protocol, domain, ip, port):
+        # 先过全局限速，按请求结果调整端点的并发窗口（窗口在派发探测时已经占用）
+        # 等待令牌期间暂停看门狗计时，拿到令牌后才开始计算期限；停止后不再发出请求
+        clock = getattr(self.local, 'clock', None)
+        if clock:
+            clock[0] = None
+        if self.rate_limiter:
+            self._wait_token()
+        elif self.should_stop and self.should_stop():
+            raise ProbeStopped()
+        if clock:
+            clock[0] = time.monotonic()
+        if not self.limiter:
+            return self._request(protocol, domain, ip, port)
+        if self.limiter.is_down((ip, port)):
+            raise EndpointDown(ip, port)
+        outcome = None
+        try:
+            response = self._request(protocol, domain, ip, port)
+            outcome = True
+            return response
+        except (urllib3.exceptions.TimeoutError, urllib3.exceptions.ProtocolError, urllib3.exceptions.NewConnectionError):
+            outcome = False
+            raise
+        finally:
+            self.limiter.feedback((ip, port), outcome)
+
+    def _wait_token(self):
+        # 分段等待令牌，令牌透支较多时也能及时响应停止
+        deadline = time.monotonic() + self.rate_limiter.reserve()
+        while True:
+            if self.should_stop and self.should_stop():
+                raise ProbeStopped()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, STOP_POLL_INTERVAL))
+
+    def _request(self, protocol, domain, ip, port):
+        headers = dict(DEFAULT_HEADERS)
+        headers['Host'] = domain
+        
+        # 发送请求
+        started = time.monotonic()
+        deadline = started + self.timeout
+        pool = self.get_pool(protocol, ip, port, domain)
+        response = pool.urlopen('GET', '/', headers=headers, redirect=False, retries=False, preload_content=False)
+        headers_received = time.monotonic()
+        if protocol == 'https':
+            self.tls_context(ip, port).remember(getattr(getattr(response, 'connection', None), 'sock', None))
+        try:
+            # 分块读取，最多max_body字节，多读1字节用于判断是否被截断
+            # 每块之间检查总耗时，防止慢速返回的服务器拖住线程
+            content = bytearray()
+            while len(content) <= self.max_body:
+                if time.monotonic() > deadline:
+                    response.close()
+                    raise urllib3.exceptions.ReadTimeoutError(pool, '/', "读取正文超时")
+                chunk = response.read(min(READ_CHUNK, self.max_body + 1 - len(content)))
+                if not chunk:
+                    break
+                content += chunk
+            truncated = len(content) > self.max_body
+            content = bytes(content[:self.max_body])
+            if truncated:
+                # 剩余正文不再读取，直接断开这条连接
+                response.close()
+        finally:
+            response.release_conn()
+        if self.metrics:
+            self.metrics.observe('first_byte', headers_received - started)
+            self.metrics.observe('body', time.monotonic() - headers_received)
+        content_length = get_content_length(response.headers.get('content-length'), len(content), truncated)
+        return response.status, response.headers.get('content-type', ''), content, content_length
+
+    def check_baseline(self, ip, port):
+        for protocol in self.protocol_cache.candidates(ip, port):
+            try:
+                for host in random_hosts():
+                    status_code, content_type, content, content_length = self.request(protocol, host, ip, port)
+                    title = parse_title(status_code, content_type, content, self.title_fallback)
+                    self.baseline_cache.add(ip, port, make_fingerprint(status_code, content_length, title, content))
+            except ProbeStopped:
+                return
+            except urllib3.exceptions.HTTPError as e:
+                self.record_error(e, ip)
+                if not wrong_protocol(e):
+                    return
+                self.protocol_cache.invalidate(ip, port, protocol)
+                continue
+            except Exception as e:
+                self.record_error(e, ip)
+                print(f"获取基线 {ip}:{port} ({protocol}) 时出错: {e}", file=sys.stderr)
+                continue
+            self.protocol_cache.confirm(ip, port, protocol)
+            return
+
+    def record_error(self, error, ip):
+        if self.metrics:
+            self.metrics.error(classify_error(error), ip)
+
+    def probe(self, domain, ip, port):
+        # 检查一个目标，同时记录在途数和完成数
+        if not self.metrics:
+            return self.check_target(domain, ip, port)
+        self.metrics.probe_started()
+        try:
+            return self.check_target(domain, ip, port)
+        finally:
+            self.metrics.probe_finished()
+
+    def check_target(self, domain, ip, port):
+        error = None
+        for protocol in self.protocol_cache.candidates(ip, port):
+            # 结果中的URL仍以域名展示，实际连接的是IP
+            url = f"{protocol}://{domain}:{port}"
+            try:
+                status_code, content_type, content, content_length = self.request(protocol, domain, ip, port)
+            except ProbeStopped:
+                raise
+            except EndpointDown as e:
+                # 端点熔断中，换协议也没有意义，直接按失败交给调用方
+                error = e
+                break
+            except urllib3.exceptions.HTTPError as e:
+                error = e
+                self.record_error(e, ip)
+                if not wrong_protocol(e):
+                    # 超时、连接被拒绝等换协议也没用，直接按失败处理，确认过的协议继续保留
+                    break
+                # 协议可能不对，缓存的协议作废，继续尝试下一个协议
+                self.protocol_cache.invalidate(ip, port, protocol)
+                continue
+            except Exception as e:
+                self.record_error(e, ip)
+                print(f"检查目标 {domain}:{port} ({protocol}) 时出错: {e}", file=sys.stderr)
+                continue
+            
+            # 能拿到HTTP响应说明协议正确，后续域名直接复用
+            self.protocol_cache.confirm(ip, port, protocol)
+            started = time.monotonic()
+            result = build_result(url, domain, ip, port, status_code, content_type, content, content_length,
+                                  self.baseline_cache, self.title_fallback)
+            if self.metrics:
+                self.metrics.observe('parse', time.monotonic() - started)
+            return result
+        
+        # 所有协议都失败，请求出错时抛出ProbeError交给调用方决定是否重试
+        if error is not None:
+            raise ProbeError(error)
+        return None
+
+# 基于asyncio/aiohttp的碰撞引擎，所有探测跑在同一个事件循环里
+class AsyncCollisionEngine:
+    def __init__(self, concurrency=500, timeout=10, protocol_cache=None, baseline_cache=None,
+                 max_body=MAX_BODY_SIZE, title_fallback=False, probe_deadline=None,
+                 rate_limit=0, adaptive=True, max_window=MAX_WINDOW, metrics=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.metrics = metrics
+        # 单个请求的硬性期限，超过即取消；从请求真正发出时开始计时，限速的等待不计入
+        self.probe_deadline = probe_deadline or timeout * 3
+        self.rate_limiter = TokenBucket(rate_limit) if rate_limit else None
+        self.limiter = AdaptiveLimiter(maximum=max_window, cooldown=timeout) if adaptive else None
+        self.max_body = max_body
+        self.title_fallback = title_fallback
+        self.protocol_cache = protocol_cache if protocol_cache is not None else ProtocolCache()
+        self.baseline_cache = baseline_cache
+        self.tls_contexts = {}  # (ip, port) -> ResumingContext
+
+    def run(self, targets, on_result=None, should_stop=None, on_complete=None, on_stuck=report_stuck, on_failed=None):
+        # 在当前线程中新建事件循环执行，阻塞直到全部完成或被停止
+        # targets中每项前三个元素为(domain, ip, port)，其余字段原样透传给on_complete
+        # 传入on_failed时，探测失败或超过期限的目标交给on_failed(target, error)，不再调用on_complete
+        return asyncio.run(self._run(targets, on_result, should_stop, on_complete, on_stuck, on_failed))
+
+    def fetch_baselines(self, endpoints, should_stop=None):
+        # 对每个端点用随机Host请求，记录默认站点指纹
+        if self.baseline_cache is None:
+            self.baseline_cache = BaselineCache()
+        return asyncio.run(self._fetch_baselines(endpoints, should_stop))
+
+    def _make_session(self):
+        # 所有探测共用一个连接器，连接按(IP, 端口)复用；每个端点的并发由自适应窗口控制，连接器只限制总数
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            ssl=False,
+            keepalive_timeout=30,
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        trace_configs = [self._make_trace()] if self.metrics else None
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=DEFAULT_HEADERS,
+                                     trace_configs=trace_configs)
+
+    def _make_trace(self):
+        # aiohttp建连的耗时包含TLS握手，无法单独拆出，统一记为connect
+        trace = aiohttp.TraceConfig()
+
+        async def on_start(session, context, params):
+            context.connect_started = time.monotonic()
+
+        async def on_end(session, context, params):
+            self.metrics.observe('connect', time.monotonic() - context.connect_started)
+
+        trace.on_connection_create_start.append(on_start)
+        trace.on_connection_create_end.append(on_end)
+        return trace
+
+    async def _run(self, targets, on_result, should_stop, on_complete, on_stuck, on_failed):
+        async with self._make_session() as session:
+            # 同一时刻最多concurrency个探测在途，只派发给窗口有空位的端点
+            # 定期检查停止标志，停止时直接取消所有在途探测；探测任务出错时取消其余任务并重新抛出
+            scheduler = TargetScheduler(targets, self.limiter)
+            running = set()
+            try:
+                while True:
+                    if should_stop and should_stop():
+                        break
+                    while len(running) < self.concurrency:
+                        target = scheduler.next()
+                        if target is None:
+                            break
+                        running.add(asyncio.create_task(
+                            self._probe_target(session, scheduler, target, on_result, on_complete, on_stuck, on_failed)
+                        ))
+                    if not running:
+                        break
+                    done, running = await asyncio.wait(running, timeout=WATCHDOG_INTERVAL,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception():
+                            raise task.exception()
+            finally:
+                for task in running:
+                    task.cancel()
+                await asyncio.gather(*running, return_exceptions=True)
+                scheduler.close()
+
+    async def _wait_workers(self, workers, should_stop):
+        # 定期检查停止标志，停止时直接取消所有在途探测，保证在有限时间内返回
+        # 任一worker出错时取消其余worker并重新抛出，调用方据此判断任务没有跑完
+        pending = set(workers)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=WATCHDOG_INTERVAL, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if not task.cancelled() and task.exception():
+                        raise task.exception()
+                if should_stop and should_stop():
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _fetch_baselines(self, endpoints, should_stop):
+        async with self._make_session() as session:
+            iterator = iter(endpoints)
+
+            async def worker():
+                for ip, port in iterator:
+                    if should_stop and should_stop():
+                        break
+                    await self.check_baseline(session, ip, port)
+
+            workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(endpoints)))]
+            if workers:
+                await self._wait_workers(workers, should_stop)
+
+    async def _probe_target(self, session, scheduler, target, on_result, on_complete, on_stuck, on_failed):
+        try:
+            result = await self.probe(session, target[0], target[1], target[2])
+        except ProbeDeadline as e:
+            # 超过硬性期限的探测视为失败
+            result = None
+            if on_stuck:
+                on_stuck(target, e.elapsed)
+            if on_failed:
+                on_failed(target, e)
+                return
+        except ProbeError as e:
+            result = None
+            if on_failed:
+                on_failed(target, e.error)
+                return
+        finally:
+            scheduler.release(target)
+        if result and on_result:
+            on_result(result)
+        if on_complete:
+            on_complete(target, result)
+
+    async def request(self, session, protocol, domain, ip, port):
+        # 先过全局限速，按请求结果调整端点的并发窗口（窗口在派发探测时已经占用）
+        # 期限只包住真正发出的请求，等待令牌的时间不计入
+        if self.rate_limiter:
+            await asyncio.sleep(self.rate_limiter.reserve())
+        if not self.limiter:
+            return await self._with_deadline(self._request(session, protocol, domain, ip, port))
+        if self.limiter.is_down((ip, port)):
+            raise EndpointDown(ip, port)
+        outcome = None
+        try:
+            response = await self._with_deadline(self._request(session, protocol, domain, ip, port))
+            outcome = True
+            return response
+        except aiohttp.ClientSSLError:
+            # TLS握手失败（包括证书错误）继承自ClientOSError，但与端点负载无关，窗口不变
+            raise
+        except (asyncio.TimeoutError, ProbeDeadline, aiohttp.ServerDisconnectedError, aiohttp.ClientOSError):
+            outcome = False
+            raise
+        finally:
+            self.limiter.feedback((ip, port), outcome)
+
+    async def _with_deadline(self, coro):
+        # 超过期限时取消请求并抛出ProbeDeadline，与请求自身的超时区分开
+        started = time.monotonic()
+        task = asyncio.ensure_future(coro)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.probe_deadline)
+        finally:
+            if not task.done():
+                task.cancel()
+        if not done:
+            raise ProbeDeadline(time.monotonic() - started)
+        return task.result()
+
+    def tls_context(self, ip, port):
+        # 每个端点一个SSLContext，新连接恢复该端点上次的TLS会话
+        context = self.tls_contexts.get((ip, port))
+        if context is None:
+            context = self.tls_contexts[(ip, port)] = ResumingContext()
+        return context
+
+    async def _request(self, session, protocol, domain, ip, port):
+        # 实际连接的是IP，Host头和SNI使用域名
+        kwargs = {}
+        if protocol == 'https':
+            kwargs = {'server_hostname': domain, 'ssl': self.tls_context(ip, port)}
+        started = time.monotonic()
+        async with session.get(build_url(protocol, ip, port), headers={'Host': domain},
+                               allow_redirects=False, **kwargs) as response:
+            headers_received = time.monotonic()
+            # 最多读取max_body字节，多读1字节用于判断是否被截断，剩余正文随连接一起丢弃
+            content = bytearray()
+            while len(content) <= self.max_body:
+                chunk = await response.content.read(self.max_body + 1 - len(content))
+                if not chunk:
+                    break
+                content += chunk
+            truncated = len(content) > self.max_body
+            content = bytes(content[:self.max_body])
+            if self.metrics:
+                self.metrics.observe('first_byte', headers_received - started)
+                self.metrics.observe('body', time.monotonic() - headers_received)
+            content_length = get_content_length(response.headers.get('content-length'), len(content), truncated)
+            return response.status, response.headers.get('content-type', ''), content, content_length
+
+    async def check_baseline(self, session, ip, port):
+        for protocol in self.protocol_cache.candidates(ip, port):
+            try:
+                for host in random_hosts():
+                    status_code, content_type, content, content_length = await self.request(session, protocol, host, ip, port)
+                    title = parse_title(status_code, content_type, content, self.title_fallback)
+                    self.baseline_cache.add(ip, port, make_fingerprint(status_code, content_length, title, content))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.record_error(e, ip)
+                if not wrong_protocol(e):
+                    return
+                self.protocol_cache.invalidate(ip, port, protocol)
+                continue
+            except Exception as e:
+                self.record_error(e, ip)
+                print(f"获取基线 {ip}:{port} ({protocol}) 时出错: {e}", file=sys.stderr)
+                continue
+            self.protocol_cache.confirm(ip, port, protocol)
+            return
+
+    def record_error(self, error, ip):
+        if self.metrics:
+            self.metrics.error(classify_error(error), ip)
+
+    async def probe(self, session, domain, ip, port):
+        # 检查一个目标，同时记录在途数和完成数
+        if not self.metrics:
+            return await self.check_target(session, domain, ip, port)
+        self.metrics.probe_started()
+        try:
+            return await self.check_target(session, domain, ip, port)
+        finally:
+            self.metrics.probe_finished()
+
+    async def check_target(self, session, domain, ip, port):
+        error = None
+        for protocol in self.protocol_cache.candidates(ip, port):
+            # 结果中的URL仍以域名展示
+            url = f"{protocol}://{domain}:{port}"
+            try:
+                status_code, content_type, content, content_length = await self.request(session, protocol, domain, ip, port)
+            except ProbeDeadline:
+                # 超过期限的目标直接放弃，不再回退到其他协议，由调用方按放弃统计
+                raise
+            except EndpointDown as e:
+                # 端点熔断中，换协议也没有意义，直接按失败交给调用方
+                error = e
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+                self.record_error(e, ip)
+                if not wrong_protocol(e):
+                    # 超时、连接被拒绝等换协议也没用，直接按失败处理，确认过的协议继续保留
+                    break
+                # 协议可能不对，缓存的协议作废，继续尝试下一个协议
+                self.protocol_cache.invalidate(ip, port, protocol)
+                continue
+            except Exception as e:
+                self.record_error(e, ip)
+                print(f"检查目标 {domain}:{port} ({protocol}) 时出错: {e}", file=sys.stderr)
+                continue
+            
+            # 能拿到HTTP响应说明协议正确，后续域名直接复用
+            self.protocol_cache.confirm(ip, port, protocol)
+            started = time.monotonic()
+            result = build_result(url, domain, ip, port, status_code, content_type, content, content_length,
+                                  self.baseline_cache, self.title_fallback)
+            if self.metrics:
+                self.metrics.observe('parse', time.monotonic() - started)
+            return result
+
+        # 所有协议都失败，请求出错时抛出ProbeError交给调用方决定是否重试
+        if error is not None:
+            raise ProbeError(error)
+        return None
+
+# 重试车道：主车道探测失败或超时的目标放到这里，用单独的小并发线程池按指数退避重试
+# 无论主车道用哪个引擎，重试都用线程引擎，主车道结束后等重试队列清空
+class RetryLane:
+    def __init__(self, engine, max_attempts=3, backoff=2.0, on_result=None, on_complete=None, should_stop=None,
+                 on_give_up=None):
+        self.engine = engine
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.on_result = on_result
+        self.on_complete = on_complete
+        self.on_give_up = on_give_up  # 传入时放弃的目标交给on_give_up(target, error)，不再调用on_complete
+        self.should_stop = should_stop
+        engine.should_stop = should_stop
+        self.queue = []  # (可以重试的时间, 序号, 已尝试次数, 目标)
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.active = 0  # 已提交给线程池还没结束的重试数
+        self.closed = False
+        self.retried = 0
+        self.given_up = 0
+        self.executor = ThreadPoolExecutor(max_workers=engine.concurrency)
+        self.scheduler = threading.Thread(target=self._schedule, daemon=True)
+        self.scheduler.start()
+
+    def submit(self, target, error, attempt=1):
+        # attempt为该目标已经失败的次数，达到上限后按未命中处理
+        # 已停止时直接丢弃，不记为完成，断点续扫时会重新探测
+        if self.should_stop and self.should_stop():
+            return
+        if attempt >= self.max_attempts:
+            with self.condition:
+                if self.closed:
+                    return
+                self.given_up += 1
+                if self.on_give_up:
+                    self.on_give_up(target, error)
+                elif self.on_complete:
+                    self.on_complete(target, None)
+            return
+        # 退避时间按次数翻倍，加随机抖动避免同一端点的目标同时重试
+        delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+        with self.condition:
+            if self.closed:
+                return
+            heapq.heappush(self.queue, (time.monotonic() + delay, next(self.counter), attempt, target))
+            self.condition.notify_all()
+
+    def _schedule(self):
+        while True:
+            with self.condition:
+                while not self.closed and (not self.queue or self.active >= self.engine.concurrency
+                                           or self.queue[0][0] > time.monotonic()):
+                    timeout = WATCHDOG_INTERVAL
+                    if self.queue and self.active < self.engine.concurrency:
+                        timeout = min(timeout, self.queue[0][0] - time.monotonic())
+                    self.condition.wait(max(timeout, 0))
+                if self.closed:
+                    return
+                _, _, attempt, target = heapq.heappop(self.queue)
+                self.active += 1
+                self.retried += 1
+            self.executor.submit(self._attempt, target, attempt)
+
+    def _attempt(self, target, attempt):
+        try:
+            result = None
+            try:
+                result = self.engine.probe(target[0], target[1], target[2])
+            except ProbeStopped:
+                return
+            except ProbeError as e:
+                self.submit(target, e.error, attempt + 1)
+                return
+            except Exception as e:
+                print(f"重试目标 {target[0]}:{target[2]} 时出错: {e}", file=sys.stderr)
+            # 回调在锁内执行并先检查是否已关闭：停止时finish不等在途重试，
+            # 它返回后调用方会关闭断点和缓存，之后结束的重试不再回调，断点续扫时重新探测
+            with self.condition:
+                if self.closed:
+                    return
+                if result and self.on_result:
+                    self.on_result(result)
+                if self.on_complete:
+                    self.on_complete(target, result)
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+    def finish(self):
+        # 阻塞到重试队列清空；停止时未重试和仍在重试的目标不调用on_complete，断点续扫时会重新探测
+        # 返回后不会再有回调
+        try:
+            with self.condition:
+                while self.queue or self.active:
+                    if self.should_stop and self.should_stop():
+                        break
+                    self.condition.wait(WATCHDOG_INTERVAL)
+                self.closed = True
+                self.condition.notify_all()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.engine.close()
@@ -0,0 +1,86 @@
+import hashlib
+import ipaddress
+import mmap
+import os
+import tempfile
+from itertools import chain, islice
+
+# 界面上预览的行数
+PREVIEW_LINES = 200
+
+def iter_file_lines(path):
+    # 用mmap逐行读取，不把整个文件读进内存
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for raw in iter(mm.readline, b''):
+                line = raw.decode('utf-8', errors='ignore').strip().lstrip('\ufeff')
+                if line:
+                    yield line
+
+def normalize(kind, value):
+    # 统一大小写和写法，让同一个输入只出现一次
+    value = value.strip()
+    if kind == 'ip':
+        try:
+            return str(ipaddress.ip_address(value.strip('[]')))
+        except ValueError:
+            return value
+    value = value.lower()
+    if kind == 'prefix':
+        return value.strip('.')
+    # 域名去掉协议、路径和末尾的点
+    if '://' in value:
+        value = value.split('://', 1)[1]
+    value = value.split('/', 1)[0]
+    if value.startswith('*.'):
+        value = value[2:]
+    return value.strip('.')
+
+def unique(kind, values):
+    # 规范化并去重，只保存8字节哈希，比保存字符串本身省内存
+    seen = set()
+    for value in values:
+        value = normalize(kind, value)
+        if not value:
+            continue
+        key = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+        if key in seen:
+            continue
+        seen.add(key)
+        yield value
+
+def dedupe(kind, values):
+    return list(unique(kind, values))
+
+# 去重后写在临时文件里的输入列表，每次遍历都从磁盘流式读取，可多次遍历
+class InputList:
+    def __init__(self, path, count):
+        self.path = path
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter_file_lines(self.path)
+
+    def preview(self, limit=PREVIEW_LINES):
+        return list(islice(self, limit))
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def load_input(kind, paths=(), values=()):
+    # 合并多个文件和直接给出的值，规范化去重后写入临时文件
+    fd, path = tempfile.mkstemp(prefix=f'collision_{kind}_', suffix='.txt')
+    count = 0
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for value in unique(kind, chain(values, *(iter_file_lines(p) for p in paths))):
+            f.write(value + '\n')
+            count += 1
+    return InputList(path, count)
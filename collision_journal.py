@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+from collision_engine import CollisionResult, CertificateNames, RESULT_FIELDS
+
+# 默认断点文件
+JOURNAL_FILE = "collision_journal.db"
+
+def make_run_key(*parts):
+    # 根据全部输入计算本次扫描的标识，输入相同才能续扫
+    digest = hashlib.sha256()
+    for part in parts:
+        for item in part:
+            digest.update(str(item).encode('utf-8'))
+            digest.update(b'\n')
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+# 基于SQLite的断点日志：记录已完成目标的序号和结果，分批写入
+class CollisionJournal:
+    def __init__(self, path, run_key, batch_size=2000, flush_interval=2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.done_buffer = []
+        self.result_buffer = []
+        self.last_flush = time.monotonic()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS done (idx INTEGER PRIMARY KEY) WITHOUT ROWID")
+        # 结果字段变化后，旧版本的断点无法沿用
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(results)")]
+        if columns and columns != ['idx'] + list(RESULT_FIELDS):
+            with self.conn:
+                self.conn.execute("DROP TABLE results")
+                self.conn.execute("DELETE FROM meta")
+                self.conn.execute("DELETE FROM done")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (idx INTEGER PRIMARY KEY, url TEXT, domain TEXT, ip TEXT, "
+            "port INTEGER, title TEXT, status_code INTEGER, content_length INTEGER, resolved TEXT)"
+        )
+
+        # 输入变化时旧的断点作废
+        if self.get_meta('run_key') != run_key:
+            with self.conn:
+                self.conn.execute("DELETE FROM meta")
+                self.conn.execute("DELETE FROM done")
+                self.conn.execute("DELETE FROM results")
+                self.conn.execute("INSERT INTO meta VALUES ('run_key', ?)", (run_key,))
+        self.watermark, self.done = self.load_done()
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def load_done(self):
+        # 序号连续完成的部分压缩成水位线，只有水位线之后零散完成的序号留在内存
+        watermark = int(self.get_meta('watermark') or 0)
+        done = set()
+        for (index,) in self.conn.execute("SELECT idx FROM done ORDER BY idx"):
+            if index == watermark:
+                watermark += 1
+            elif index > watermark:
+                done.add(index)
+        with self.conn:
+            self.conn.execute("DELETE FROM done WHERE idx < ?", (watermark,))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('watermark', ?)", (str(watermark),))
+        return watermark, done
+
+    @property
+    def completed_count(self):
+        return self.watermark + len(self.done)
+
+    def load_endpoints(self):
+        # 上次扫描使用的端点列表（预扫描之后），续扫时沿用以保证序号一致
+        value = self.get_meta('endpoints')
+        if value is None:
+            return None
+        return [(ip, port) for ip, port in json.loads(value)]
+
+    def save_endpoints(self, endpoints):
+        self.set_meta('endpoints', json.dumps(endpoints))
+
+    def load_certificates(self):
+        # 上次收集的证书域名，续扫时沿用以保证目标顺序一致
+        value = self.get_meta('certificates')
+        if value is None:
+            return None
+        return CertificateNames.from_json(json.loads(value))
+
+    def save_certificates(self, certificates):
+        self.set_meta('certificates', json.dumps(certificates.to_json()))
+
+    def load_pointing(self):
+        # 上次解析到扫描IP的域名，续扫时沿用以保证目标顺序一致
+        value = self.get_meta('dns_pointing')
+        if value is None:
+            return None
+        return {domain: tuple(addresses) for domain, addresses in json.loads(value).items()}
+
+    def save_pointing(self, pointing):
+        self.set_meta('dns_pointing', json.dumps(pointing))
+
+    def load_results(self):
+        # 逐行读取，已有结果很多时也不会一次全部载入内存
+        rows = self.conn.execute(f"SELECT {', '.join(RESULT_FIELDS)} FROM results ORDER BY idx")
+        for row in rows:
+            yield CollisionResult(*row)
+
+    def pending_targets(self, targets):
+        # 给目标附加序号，并跳过已完成的目标
+        index = self.watermark
+        for target in islice(targets, self.watermark, None):
+            if index not in self.done:
+                yield (target[0], target[1], target[2], index)
+            index += 1
+
+    def record(self, target, result):
+        # 作为引擎的on_complete回调，target最后一个字段是序号
+        with self.lock:
+            self.done_buffer.append((target[-1],))
+            if result:
+                self.result_buffer.append((target[-1],) + tuple(getattr(result, field) for field in RESULT_FIELDS))
+            if len(self.done_buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        # 结果和完成标记在同一个事务中写入
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO results VALUES ({', '.join('?' * (len(RESULT_FIELDS) + 1))})",
+                                  self.result_buffer)
+            self.conn.executemany("INSERT OR IGNORE INTO done VALUES (?)", self.done_buffer)
+        self.done_buffer = []
+        self.result_buffer = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def discard(self):
+        # 扫描正常完成后删除断点文件
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.path + suffix)
+            except OSError:
+                pass
@@ -0,0 +1,154 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+
+# 探测各阶段：TCP连接、TLS握手、首字节（从发请求到收到响应头）、读正文、解析标题和指纹
+PHASES = ('connect', 'tls', 'first_byte', 'body', 'parse')
+# 延迟直方图各桶的上界（毫秒），最后一桶收纳更慢的
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+# 计算实时速率的时间窗口（秒）
+RATE_WINDOW = 5.0
+# 按IP统计错误时输出的IP数
+TOP_ERROR_IPS = 20
+
+ERROR_NAMES = {
+    'timeout': '超时',
+    'connect': '连接',
+    'tls': 'TLS',
+    'reset': '断开',
+    'deadline': '放弃',
+    'other': '其他',
+}
+
+# 固定分桶的延迟直方图，分位数取所在桶的上界
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect_left(LATENCY_BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q):
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else round(self.max, 1)
+        return round(self.max, 1)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count, 1) if self.count else 0,
+            'p50_ms': self.percentile(0.5),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max, 1),
+            'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['inf'], self.counts)),
+        }
+
+# 一次碰撞任务的运行指标，引擎在各线程或协程中写入，界面和命令行定期读取快照
+class CollisionMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.probes = 0
+        self.in_flight = 0
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.errors = Counter()
+        self.ip_errors = Counter()
+        self.samples = deque()  # (时间, 已完成探测数)，用于计算最近的速率
+        self.raw = {}  # 阶段 -> 原始耗时（秒）列表，只记录keep_raw指定的阶段
+
+    def probe_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def probe_finished(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.probes += 1
+
+    def keep_raw(self, *phases):
+        # 直方图分桶较粗，需要精确分位数时（例如基准测试）另外保留指定阶段的原始耗时
+        with self.lock:
+            for phase in phases:
+                self.raw.setdefault(phase, [])
+
+    def observe(self, phase, seconds):
+        with self.lock:
+            self.phases[phase].observe(seconds * 1000)
+            if phase in self.raw:
+                self.raw[phase].append(seconds)
+
+    def error(self, category, ip=None):
+        with self.lock:
+            self.errors[category] += 1
+            if ip is not None:
+                self.ip_errors[ip] += 1
+
+    def _rate(self, now):
+        # 最近RATE_WINDOW秒内的速率，采样点在每次取快照时记录
+        self.samples.append((now, self.probes))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= RATE_WINDOW:
+            self.samples.popleft()
+        then, probes = self.samples[0] if len(self.samples) > 1 else (self.started, 0)
+        return (self.probes - probes) / (now - then) if now > then else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.started
+            return {
+                'elapsed': round(elapsed, 1),
+                'probes': self.probes,
+                'in_flight': self.in_flight,
+                'probes_per_sec': round(self._rate(now), 1),
+                'avg_probes_per_sec': round(self.probes / elapsed, 1) if elapsed > 0 else 0,
+                'phases': {phase: histogram.to_dict() for phase, histogram in self.phases.items()},
+                'errors': dict(self.errors),
+                'errors_by_ip': dict(self.ip_errors.most_common(TOP_ERROR_IPS)),
+            }
+
+    def summary(self):
+        # 界面上显示的一行摘要
+        snapshot = self.snapshot()
+        first_byte = snapshot['phases']['first_byte']
+        text = (f"速率 {snapshot['probes_per_sec']}/s，在途 {snapshot['in_flight']}，"
+                f"首字节 p50 {first_byte['p50_ms']}ms / p99 {first_byte['p99_ms']}ms")
+        if snapshot['errors']:
+            details = '、'.join(f"{ERROR_NAMES.get(name, name)}{count}" for name, count in
+                               sorted(snapshot['errors'].items(), key=lambda item: -item[1]))
+            text += f"，错误 {sum(snapshot['errors'].values())}（{details}）"
+        return text
+
+    def dump(self, path):
+        # 先写临时文件再替换，读取方不会看到写了一半的文件
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+def profile_call(path, func, *args, **kwargs):
+    # 用cProfile包住一次调用，结果写入path，可用pstats或snakeviz查看
+    # 只能看到当前线程：异步引擎的全部探测都在这里，线程引擎只有调度部分
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,339 @@
+import math
+import sys
+import threading
+import time
+from collision_engine import (
+    ThreadCollisionEngine, AsyncCollisionEngine, ProtocolCache, MAX_BODY_SIZE, MAX_WINDOW, MAX_POOLS,
+    make_endpoints, iter_domains, iter_targets, count_targets, scan_live_endpoints, report_stuck, shard_targets,
+    harvest_certificates, plan_certificate_targets, prioritized_targets, RetryLane
+)
+from collision_cache import ScanCache, NEGATIVE_TTL, RESULT_TTL
+from collision_dns import DnsCache, DnsResolver, count_pointing, filter_pointing
+from collision_journal import CollisionJournal, make_run_key
+from collision_metrics import CollisionMetrics, profile_call
+
+# Windows上没有resource模块，也没有打开文件数的软限制
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 可选引擎
+ENGINES = {"thread": ThreadCollisionEngine, "async": AsyncCollisionEngine}
+# 各引擎允许的最大并发数
+MAX_CONCURRENCY = {"thread": 1000, "async": 20000}
+# 请求超时（秒）
+DEFAULT_TIMEOUT = 10
+# 失败目标的重试次数和重试车道的并发数
+DEFAULT_RETRIES = 2
+RETRY_CONCURRENCY = 20
+# 预扫描和收集证书的并发数
+SCAN_CONCURRENCY = 1000
+# 给断点、缓存、结果文件和DNS等预留的文件描述符数
+RESERVED_FILES = 100
+
+def raise_file_limit():
+    # 每个在途探测占用一个socket，默认1024的软限制下高并发会以EMFILE失败，这里把软限制提到硬限制
+    # 返回提高后的软限制，没有限制或不支持时返回None
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            return None if hard == resource.RLIM_INFINITY else hard
+        except (ValueError, OSError):
+            # macOS的硬限制可能是无限，但软限制不能超过系统上限
+            pass
+    return soft
+
+# 一次完整的碰撞任务：预扫描 -> 断点恢复 -> 基线 -> 碰撞，GUI和命令行共用
+class CollisionRunner:
+    def __init__(self, ips, ports, subdomains=(), main_domains=(), prefixes=(), engine="async",
+                 concurrency=500, max_body=MAX_BODY_SIZE, prescan=True, baseline=True,
+                 journal_file=None, title_fallback=False, max_duration=None,
+                 rate_limit=0, adaptive=True, max_window=MAX_WINDOW, shard=None, profile_file=None,
+                 cert_harvest=True, cert_names=False, dns_mode="off", dns_servers=(), dns_cache_file=None,
+                 dns_concurrency=200, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 retry_concurrency=RETRY_CONCURRENCY, cache_file=None, cache_ttl=NEGATIVE_TTL,
+                 cache_result_ttl=RESULT_TTL):
+        # 输入可以是列表，也可以是磁盘上的InputList，只需支持len()和重复遍历
+        self.subdomains = subdomains
+        self.main_domains = main_domains
+        self.prefixes = prefixes
+        self.endpoints = make_endpoints(ips, ports)
+        self.engine_class = ENGINES[engine]
+        self.concurrency = concurrency
+        self.max_body = max_body
+        self.prescan = prescan
+        self.baseline = baseline
+        self.journal_file = journal_file
+        self.title_fallback = title_fallback
+        self.max_duration = max_duration  # 整个任务的最长运行时间（秒），到时自动停止
+        self.rate_limit = rate_limit  # 全局每秒请求数，0表示不限速
+        self.adaptive = adaptive
+        self.max_window = max_window
+        self.shard = shard  # (index, count)，只扫描目标空间中的一个分片
+        self.profile_file = profile_file  # 指定时用cProfile记录碰撞阶段
+        self.cert_harvest = cert_harvest  # 收集https端点证书上的域名，匹配的目标优先探测
+        self.cert_names = cert_names  # 证书上有但不在候选中的域名也加入探测
+        self.dns_mode = dns_mode  # 见collision_dns.DNS_MODES
+        self.dns_servers = dns_servers  # 为空时使用系统解析
+        self.dns_cache_file = dns_cache_file
+        self.dns_concurrency = dns_concurrency
+        self.timeout = timeout
+        self.retries = retries  # 超时或连接失败的目标最多再试几次，0表示不重试
+        self.retry_concurrency = retry_concurrency
+        self.cache_file = cache_file  # 指定时只探测缓存中没有或已过期的目标
+        self.cache_ttl = cache_ttl
+        self.cache_result_ttl = cache_result_ttl
+        self.cache = None
+        self.metrics = CollisionMetrics()
+        self.stopped = False
+        self.completed = 0
+        self.abandoned = 0
+        self.retried = 0
+        self.given_up = 0
+        self.set_total(self.endpoints, None)
+
+    def stop(self):
+        self.stopped = True
+
+    def run(self, on_result=None, on_status=None, on_total=None, should_stop=None, on_complete=None, on_change=None):
+        # 阻塞执行整个任务，返回True表示正常跑完，False表示被停止
+        # self.completed随每个探测完成累加（包括未命中的），供界面轮询进度
+        # 使用扫描缓存时，与上次相比新增、消失或变化的结果调用on_change(类型, 本次结果, 上次结果)
+        status = on_status or (lambda text: None)
+        started = time.monotonic()
+
+        def stop():
+            if self.max_duration and time.monotonic() - started > self.max_duration:
+                self.stopped = True
+            return self.stopped or (should_stop is not None and should_stop())
+
+        # 打开文件数不够时降低并发，而不是让探测因EMFILE失败被当作连接失败
+        concurrency = self.concurrency
+        scan_concurrency = SCAN_CONCURRENCY
+        max_pools = MAX_POOLS
+        file_limit = raise_file_limit()
+        if file_limit is not None:
+            budget = max(2, file_limit - RESERVED_FILES)
+            scan_concurrency = min(scan_concurrency, budget)
+            if concurrency + self.retry_concurrency > budget:
+                concurrency = max(1, budget - self.retry_concurrency)
+                status(f"打开文件数上限为{file_limit}，并发数从{self.concurrency}降到{concurrency}")
+            # 线程引擎的连接池各保留空闲连接，主车道和重试车道的池数合计不超过剩余的文件数
+            max_pools = min(max_pools, max(1, (budget - concurrency - self.retry_concurrency) // 2))
+
+        endpoints = self.endpoints
+        prescan = self.prescan
+        protocol_cache = ProtocolCache()
+        certificates = None
+        pointing = None
+        resumed = False
+
+        # 断点日志：输入相同则沿用上次的端点列表，跳过已完成的目标
+        journal = None
+        if self.journal_file:
+            journal = CollisionJournal(self.journal_file, make_run_key(self.subdomains, self.main_domains, self.prefixes, endpoints,
+                                                                       self.shard or (), [self.cert_harvest, self.cert_names, self.dns_mode]))
+            saved_endpoints = journal.load_endpoints()
+            if saved_endpoints is not None:
+                endpoints = saved_endpoints
+                prescan = False
+                resumed = True
+                certificates = journal.load_certificates()
+                pointing = journal.load_pointing()
+                self.set_total(endpoints, on_total)
+                for result in journal.load_results():
+                    if on_result:
+                        on_result(result)
+                self.completed = journal.completed_count
+                status(f"断点续扫，已完成{journal.completed_count}个目标，共{self.total}个目标")
+
+        # 先对每个(ip, port)做一次TCP存活探测，只对存活端点展开域名，非标准端口同时确定协议
+        if prescan:
+            status(f"端口存活预扫描，共{len(endpoints)}个端点")
+            try:
+                endpoints = scan_live_endpoints(endpoints, scan_concurrency, should_stop=stop, protocol_cache=protocol_cache)
+            except Exception as e:
+                print(f"端口预扫描出错: {e}", file=sys.stderr)
+            self.set_total(endpoints, on_total)
+            status(f"存活端点{len(endpoints)}个，共{self.total}个目标")
+        if journal and not stop():
+            journal.save_endpoints(endpoints)
+        
+        # 每个https端点握手一次取证书域名，与之匹配的候选域名排到最前面
+        if self.cert_harvest and certificates is None and not stop():
+            status(f"获取证书域名，共{len(endpoints)}个端点")
+            try:
+                certificates = harvest_certificates(endpoints, protocol_cache, scan_concurrency, should_stop=stop)
+            except Exception as e:
+                print(f"获取证书出错: {e}", file=sys.stderr)
+            if journal and certificates is not None and not stop():
+                journal.save_certificates(certificates)
+
+        # 批量解析候选域名：结果上标注解析地址，可选跳过或后置域名已解析到该IP的目标
+        resolver = None
+        if self.dns_mode != "off" and not stop():
+            status("批量解析候选域名")
+            resolver = DnsResolver(self.dns_servers, concurrency=self.dns_concurrency, cache=DnsCache(self.dns_cache_file))
+            try:
+                resolver.resolve_all(iter_domains(self.subdomains, self.main_domains, self.prefixes), stop)
+            except Exception as e:
+                print(f"DNS解析出错: {e}", file=sys.stderr)
+            status(f"{len(resolver.resolved)}个候选域名可以解析")
+            if self.dns_mode in ("skip", "defer") and pointing is None and not stop():
+                ips = {ip for ip, port in endpoints}
+                pointing = {}
+                for domain, addresses in resolver.resolved.items():
+                    addresses = tuple(address for address in addresses if address in ips)
+                    if addresses:
+                        pointing[domain] = addresses
+                if journal:
+                    journal.save_pointing(pointing)
+
+        # 线程引擎使用线程池，异步引擎在单个事件循环里承载全部并发探测
+        engine_options = {'max_pools': max_pools} if self.engine_class is ThreadCollisionEngine else {}
+        engine = self.engine_class(concurrency=concurrency, timeout=self.timeout, protocol_cache=protocol_cache,
+                                   max_body=self.max_body, title_fallback=self.title_fallback,
+                                   rate_limit=self.rate_limit, adaptive=self.adaptive, max_window=self.max_window,
+                                   metrics=self.metrics, **engine_options)
+
+        # 用随机Host获取每个端点的默认站点指纹，与之相同的响应不计入结果
+        if self.baseline and not stop():
+            status(f"获取默认站点基线，共{len(endpoints)}个端点")
+            try:
+                engine.fetch_baselines(endpoints, stop)
+            except Exception as e:
+                print(f"获取基线出错: {e}", file=sys.stderr)
+
+        extra = []
+        if certificates:
+            priority, matched, extra = plan_certificate_targets(certificates, self.subdomains, self.main_domains,
+                                                                self.prefixes, endpoints, self.cert_names)
+            status(f"{len(certificates)}个端点有证书域名，{matched}个目标与证书匹配，优先探测其中{len(priority)}个域名，"
+                   f"新增{len(extra)}个证书域名目标")
+            make_targets = lambda: prioritized_targets(certificates, priority, extra, self.subdomains, self.main_domains,
+                                                       self.prefixes, endpoints)
+        else:
+            make_targets = lambda: iter_targets(self.subdomains, self.main_domains, self.prefixes, endpoints)
+        skipped = 0
+        if pointing and self.dns_mode in ("skip", "defer"):
+            # 域名公网解析就指向该IP的目标谈不上碰撞
+            targets = filter_pointing(make_targets, pointing, self.dns_mode)
+            pointing_count = count_pointing(pointing, endpoints)
+            if self.dns_mode == "skip":
+                skipped = pointing_count
+                status(f"跳过{pointing_count}个域名已解析到该IP的目标")
+            else:
+                status(f"{pointing_count}个域名已解析到该IP的目标放到最后探测")
+        else:
+            targets = make_targets()
+        self.set_total(endpoints, on_total, len(extra) - skipped)
+        status(f"开始碰撞，共{self.total}个目标")
+        if self.shard:
+            targets = shard_targets(targets, *self.shard)
+        if journal:
+            targets = journal.pending_targets(targets)
+
+        # 扫描缓存放在断点之后过滤，缓存内容变化不影响断点的目标序号
+        cache = None
+        if self.cache_file:
+            cache = ScanCache(self.cache_file, protocol_cache, self.cache_ttl, self.cache_result_ttl, on_change, resumed)
+            self.cache = cache
+
+        def annotate(result):
+            result.resolved = ','.join(resolver.addresses(result.domain))
+            if on_result:
+                on_result(result)
+
+        found = annotate if resolver else on_result
+
+        # 重试车道在自己的线程里回调，完成计数需要加锁
+        complete_lock = threading.Lock()
+
+        def complete(target, result, failed=False):
+            with complete_lock:
+                self.completed += 1
+            if journal:
+                journal.record(target, result)
+            if cache:
+                cache.record(target, result, failed)
+            if on_complete:
+                on_complete(target, result)
+
+        def give_up(target, error):
+            # 重试后仍失败，算作完成，但不作为未命中写入缓存
+            complete(target, None, True)
+
+        def cached(target, result):
+            # 缓存中未过期的目标不探测，直接沿用上次的结果
+            with complete_lock:
+                self.completed += 1
+            if journal:
+                journal.record(target, result)
+            if result and on_result:
+                on_result(result)
+            if on_complete:
+                on_complete(target, result)
+
+        if cache:
+            targets = cache.pending_targets(targets, cached)
+
+        # 失败的目标交给重试车道，主车道不为它们多等；重试用更长的超时、不做自适应窗口，与主车道共用限速
+        lane = None
+        if self.retries > 0:
+            retry_engine = ThreadCollisionEngine(concurrency=self.retry_concurrency, timeout=self.timeout * 2,
+                                                 protocol_cache=protocol_cache, baseline_cache=engine.baseline_cache,
+                                                 max_body=self.max_body, title_fallback=self.title_fallback,
+                                                 adaptive=False, metrics=self.metrics, rate_limiter=engine.rate_limiter,
+                                                 max_pools=max_pools)
+            lane = RetryLane(retry_engine, self.retries + 1, on_result=found, on_complete=complete, should_stop=stop,
+                             on_give_up=give_up)
+
+        def stuck(target, elapsed):
+            self.abandoned += 1
+            self.metrics.error('deadline', target[1])
+            report_stuck(target, elapsed)
+
+        failed = False
+        on_failed = lane.submit if lane else give_up
+        try:
+            if self.profile_file:
+                profile_call(self.profile_file, engine.run, targets, found, stop, complete, stuck, on_failed)
+            else:
+                engine.run(targets, found, stop, complete, stuck, on_failed)
+        except Exception as e:
+            failed = True
+            print(f"碰撞引擎运行出错: {e}", file=sys.stderr)
+        if lane:
+            if lane.queue or lane.active:
+                status(f"主车道完成，等待重试队列中的{len(lane.queue) + lane.active}个目标")
+            lane.finish()
+            self.retried = lane.retried
+            self.given_up = lane.given_up
+
+        # 正常跑完则删除断点，被停止或异常时保留以便续扫
+        finished = not stop() and not failed
+        if cache:
+            # 只有跑完整个扫描范围，才能判断没有再确认的命中结果已经消失
+            if finished:
+                cache.finish(self.endpoints, self.shard)
+            cache.close()
+            status(f"跳过缓存中未过期的目标{cache.cached}个，与上次扫描相比：{cache.summary()}")
+        if journal:
+            journal.close()
+            if finished:
+                journal.discard()
+        return finished
+
+    def set_total(self, endpoints, on_total, extra=0):
+        self.total = count_targets(self.subdomains, self.main_domains, self.prefixes, endpoints) + extra
+        if self.shard:
+            # 哈希分片大小只能估算
+            self.total = math.ceil(self.total / self.shard[1])
+        if on_total:
+            on_total(self.total)
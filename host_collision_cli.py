@@ -0,0 +1,289 @@
+# 命令行版本：不依赖tkinter，适合在无图形界面的服务器上运行，结果以JSON行实时输出
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+from collision_engine import CollisionResult, MAX_BODY_SIZE, MAX_WINDOW, parse_shard
+from collision_journal import JOURNAL_FILE
+from collision_cache import CACHE_FILE, NEGATIVE_TTL, RESULT_TTL
+from collision_dns import DNS_MODES
+from collision_inputs import dedupe, load_input
+from collision_runner import CollisionRunner, ENGINES, MAX_CONCURRENCY, DEFAULT_TIMEOUT, DEFAULT_RETRIES, RETRY_CONCURRENCY
+from result_store import JsonlExporter, open_exporter
+
+# 指标文件的刷新间隔（秒）
+METRICS_INTERVAL = 5
+DAY = 24 * 3600
+
+def parse_ports(value):
+    ports = [int(p.strip()) for p in value.split(',') if p.strip()]
+    for port in ports:
+        if port < 1 or port > 65535:
+            raise argparse.ArgumentTypeError("端口必须在1-65535之间")
+    return ports
+
+def shard_spec(value):
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def merge_results(paths, exporter):
+    # 合并多个JSON行结果文件，按(URL, IP)去重后交给exporter写出，返回写出的结果数
+    seen = set()
+    count = 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                key = (record['url'], record['ip'])
+                if key in seen:
+                    continue
+                seen.add(key)
+                exporter.write(CollisionResult(**record))
+                count += 1
+    return count
+
+def open_output(args):
+    # -o指定时按扩展名选择格式，否则JSON行输出到标准输出
+    return open_exporter(args.output) if args.output else JsonlExporter(file=sys.stdout)
+
+def close_output(args, exporter):
+    if args.output:
+        exporter.close()
+
+def run_workers(args, argv):
+    # 本机启动多个子进程，各自扫描一个分片，结束后合并结果
+    # 分片结果一律写JSON行，合并时再按-o的扩展名输出
+    base = args.output or "collision_result.jsonl"
+    parts = [f"{base}.shard{i}.jsonl" for i in range(args.workers)]
+    procs = []
+    for i, part in enumerate(parts):
+        # 追加的参数覆盖原参数：每个子进程单独的分片、输出和断点文件
+        cmd = [sys.executable, os.path.abspath(__file__)] + argv + ['--workers', '1', '--shard', f"{i}/{args.workers}", '-o', part]
+        if args.resume:
+            cmd += ['--resume', f"{args.resume}.shard{i}"]
+        if args.metrics:
+            cmd += ['--metrics', f"{args.metrics}.shard{i}"]
+        if args.profile:
+            cmd += ['--profile', f"{args.profile}.shard{i}"]
+        if args.cache:
+            cmd += ['--cache', f"{args.cache}.shard{i}"]
+        if args.changes:
+            cmd += ['--changes', f"{args.changes}.shard{i}"]
+        procs.append(subprocess.Popen(cmd))
+
+    # Ctrl+C会同时发给子进程，父进程只等待它们保存断点后退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    codes = [proc.wait() for proc in procs]
+
+    existing = [part for part in parts if os.path.exists(part)]
+    exporter = open_output(args)
+    try:
+        count = merge_results(existing, exporter)
+    finally:
+        close_output(args, exporter)
+    print(f"[*] 合并{len(existing)}个分片，共{count}个结果", file=sys.stderr, flush=True)
+
+    if all(code == 0 for code in codes):
+        for part in existing:
+            os.remove(part)
+        return 0
+    return 130
+
+def collect(kind, values, files):
+    # 合并命令行直接给出的值和文件中的值，规范化去重
+    # 有文件时去重结果写入临时文件，扫描时流式读取，不整体载入内存
+    if files:
+        return load_input(kind, files, values or [])
+    return dedupe(kind, values or [])
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Host碰撞工具（命令行版）")
+    parser.add_argument('-i', '--ip', action='append', help="IP，可多次指定")
+    parser.add_argument('-I', '--ip-file', action='append', help="IP列表文件，每行一个")
+    parser.add_argument('-d', '--domain', action='append', help="主域名，可多次指定")
+    parser.add_argument('-D', '--domain-file', action='append', help="主域名列表文件")
+    parser.add_argument('-x', '--prefix', action='append', help="域名前缀，可多次指定")
+    parser.add_argument('-X', '--prefix-file', action='append', help="域名前缀文件")
+    parser.add_argument('-s', '--subdomain', action='append', help="子域名，可多次指定")
+    parser.add_argument('-S', '--subdomain-file', action='append', help="子域名列表文件")
+    parser.add_argument('-p', '--ports', type=parse_ports, default=[80, 443], help="端口，逗号分隔（默认80,443）")
+    parser.add_argument('-c', '--concurrency', type=int, default=500, help="并发数（默认500）")
+    parser.add_argument('-e', '--engine', choices=list(ENGINES), default="async", help="碰撞引擎（默认async）")
+    parser.add_argument('-o', '--output', help="结果输出文件，扩展名为.csv时输出CSV，否则输出JSON行；默认JSON行输出到标准输出")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help=f"请求超时（秒，默认{DEFAULT_TIMEOUT}），重试时加倍")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help=f"超时或连接失败的目标在重试车道中最多再试几次，按指数退避（默认{DEFAULT_RETRIES}，0不重试）")
+    parser.add_argument('--retry-concurrency', type=int, default=RETRY_CONCURRENCY, help=f"重试车道并发数（默认{RETRY_CONCURRENCY}）")
+    parser.add_argument('--max-body', type=int, default=MAX_BODY_SIZE, help=f"每个响应最多读取的字节数（默认{MAX_BODY_SIZE}）")
+    parser.add_argument('--title-fallback', action='store_true', help="正则提取不到标题时用BeautifulSoup解析")
+    parser.add_argument('--no-prescan', action='store_true', help="关闭端口存活预扫描")
+    parser.add_argument('--no-baseline', action='store_true', help="关闭默认站点过滤")
+    parser.add_argument('--no-cert-harvest', action='store_true', help="不收集https证书域名（默认收集并优先探测匹配的目标）")
+    parser.add_argument('--cert-names', action='store_true', help="证书上出现但不在候选中的域名也加入探测")
+    parser.add_argument('--dns', choices=DNS_MODES, default="off",
+                        help="碰撞前批量解析候选域名：annotate在结果中标注解析地址，skip跳过域名已解析到该IP的目标，defer把这些目标放到最后（默认off）")
+    parser.add_argument('--resolver', action='append', help="DNS服务器地址，可多次指定（需要aiodns，默认使用系统解析）")
+    parser.add_argument('--dns-cache', metavar='FILE', help="DNS解析缓存文件，下次运行时复用未过期的结果")
+    parser.add_argument('--dns-concurrency', type=int, default=200, help="DNS解析并发数（默认200）")
+    parser.add_argument('--rate', type=float, default=0, help="全局每秒最多请求数（默认0不限速）")
+    parser.add_argument('--no-adaptive', action='store_true', help="关闭每个端点的自适应并发窗口")
+    parser.add_argument('--max-window', type=int, default=MAX_WINDOW, help=f"每个端点并发窗口上限（默认{MAX_WINDOW}）")
+    parser.add_argument('--max-time', type=float, help="整个任务的最长运行时间（秒），到时自动停止并保留断点")
+    parser.add_argument('--shard', type=shard_spec, help="只扫描第i个分片，格式i/n（i从0开始），用于多进程或多机器分工")
+    parser.add_argument('--workers', type=int, default=1, help="本机启动的扫描进程数，自动分片并合并结果")
+    parser.add_argument('--merge', nargs='+', metavar='FILE', help="只合并多个结果文件（去重）后输出，不进行扫描")
+    parser.add_argument('--metrics', metavar='FILE', help="运行指标（速率、各阶段延迟、错误分类）定期以JSON写入该文件")
+    parser.add_argument('--profile', metavar='FILE', help="用cProfile记录碰撞阶段，结果写入该文件")
+    parser.add_argument('--cache', nargs='?', const=CACHE_FILE,
+                        help=f"启用扫描缓存，可指定缓存文件（默认{CACHE_FILE}）：只探测新增或过期的目标，并报告与上次相比新增、消失和变化的结果")
+    parser.add_argument('--cache-ttl', type=float, default=NEGATIVE_TTL / DAY, help=f"未命中结果的缓存天数（默认{NEGATIVE_TTL // DAY}）")
+    parser.add_argument('--cache-result-ttl', type=float, default=RESULT_TTL / DAY, help="命中结果的缓存天数（默认0，每次重新探测）")
+    parser.add_argument('--changes', metavar='FILE', help="与上次扫描相比的变化以JSON行写入该文件（需要--cache）")
+    parser.add_argument('--resume', nargs='?', const=JOURNAL_FILE, help=f"启用断点续扫，可指定断点文件（默认{JOURNAL_FILE}）")
+    return parser
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.merge:
+        exporter = open_output(args)
+        try:
+            count = merge_results(args.merge, exporter)
+        finally:
+            close_output(args, exporter)
+        print(f"[*] 合并完成，共{count}个结果", file=sys.stderr, flush=True)
+        return 0
+
+    inputs = [
+        collect('ip', args.ip, args.ip_file),
+        collect('domain', args.domain, args.domain_file),
+        collect('prefix', args.prefix, args.prefix_file),
+        collect('subdomain', args.subdomain, args.subdomain_file),
+    ]
+    try:
+        return scan(parser, args, argv, *inputs)
+    finally:
+        for items in inputs:
+            if hasattr(items, 'close'):
+                items.close()
+
+def scan(parser, args, argv, ips, main_domains, prefixes, subdomains):
+    if not ips:
+        parser.error("请指定IP列表")
+    if not main_domains and not subdomains:
+        parser.error("请指定主域名列表或子域名列表")
+    if args.concurrency < 1 or args.concurrency > MAX_CONCURRENCY[args.engine]:
+        parser.error(f"并发数必须在1-{MAX_CONCURRENCY[args.engine]}之间")
+    if args.workers < 1:
+        parser.error("进程数必须大于0")
+    if args.timeout <= 0:
+        parser.error("超时必须大于0")
+    if args.retries < 0 or args.retry_concurrency < 1:
+        parser.error("重试次数不能小于0，重试并发数必须大于0")
+    if args.cache_ttl < 0 or args.cache_result_ttl < 0:
+        parser.error("缓存天数不能小于0")
+    if args.changes and not args.cache:
+        parser.error("--changes需要同时指定--cache")
+    if args.workers > 1:
+        if args.shard:
+            parser.error("--workers和--shard不能同时使用")
+        return run_workers(args, argv)
+
+    runner = CollisionRunner(
+        ips, args.ports,
+        subdomains=subdomains,
+        main_domains=main_domains,
+        prefixes=prefixes,
+        engine=args.engine,
+        concurrency=args.concurrency,
+        max_body=args.max_body,
+        prescan=not args.no_prescan,
+        baseline=not args.no_baseline,
+        journal_file=args.resume,
+        title_fallback=args.title_fallback,
+        max_duration=args.max_time,
+        rate_limit=args.rate,
+        adaptive=not args.no_adaptive,
+        max_window=args.max_window,
+        shard=args.shard,
+        profile_file=args.profile,
+        cert_harvest=not args.no_cert_harvest,
+        cert_names=args.cert_names,
+        dns_mode=args.dns,
+        dns_servers=args.resolver or (),
+        dns_cache_file=args.dns_cache,
+        dns_concurrency=args.dns_concurrency,
+        timeout=args.timeout,
+        retries=args.retries,
+        retry_concurrency=args.retry_concurrency,
+        cache_file=args.cache,
+        cache_ttl=args.cache_ttl * DAY,
+        cache_result_ttl=args.cache_result_ttl * DAY
+    )
+    if not runner.total:
+        parser.error("没有生成任何目标")
+
+    # 续扫时已有结果会先全部重新输出，所以输出文件总是重写
+    exporter = open_output(args)
+    output_lock = threading.Lock()
+
+    def on_result(result):
+        # 每发现一个结果立即写出一行
+        with output_lock:
+            exporter.write(result)
+
+    def on_status(text):
+        print(f"[*] {text}", file=sys.stderr, flush=True)
+
+    changes = open(args.changes, 'w', encoding='utf-8') if args.changes else None
+
+    def on_change(change, result, previous):
+        # 每条变化一行：类型、本次结果、上次结果（新增时上次为空，消失时本次为空）
+        if changes:
+            record = {
+                'change': change,
+                'result': result.to_dict() if result else None,
+                'previous': previous.to_dict() if previous else None,
+            }
+            with output_lock:
+                changes.write(json.dumps(record, ensure_ascii=False) + '\n')
+                changes.flush()
+
+    # 运行期间定期刷新指标文件，结束时再写一次最终值
+    metrics_done = threading.Event()
+
+    def dump_metrics():
+        while not metrics_done.wait(METRICS_INTERVAL):
+            runner.metrics.dump(args.metrics)
+
+    if args.metrics:
+        threading.Thread(target=dump_metrics, daemon=True).start()
+
+    # Ctrl+C时停止任务，断点保留以便续扫
+    signal.signal(signal.SIGINT, lambda signum, frame: runner.stop())
+    try:
+        finished = runner.run(on_result=on_result, on_status=on_status, on_change=on_change)
+    finally:
+        metrics_done.set()
+        if args.metrics:
+            runner.metrics.dump(args.metrics)
+        close_output(args, exporter)
+        if changes:
+            changes.close()
+    on_status(f"{'碰撞完成' if finished else '已停止'}，共检查{runner.completed}个目标，超时放弃{runner.abandoned}个，"
+              f"重试{runner.retried}次，重试后仍失败{runner.given_up}个")
+    return 0 if finished else 130
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,31 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
-import asyncio
-import aiohttp
-import requests
-from bs4 import BeautifulSoup
-import csv
 import json
 import time
 from urllib.parse import urlparse
 import os
-from concurrent.futures import ThreadPoolExecutor
 import queue
+from collections import deque
+from collision_engine import MAX_BODY_SIZE
+from collision_inputs import dedupe, load_input
+from collision_journal import JOURNAL_FILE
+from collision_cache import CACHE_FILE, CHANGE_NAMES
+from collision_runner import CollisionRunner, MAX_CONCURRENCY, DEFAULT_RETRIES
+from result_store import ResultStore, open_exporter
 
-class CollisionResult:
-    def __init__(self, url, domain, ip, port, title, status_code, content_length):
-        self.url = url
-        self.domain = domain
-        self.ip = ip
-        self.port = port
-        self.title = title
-        self.status_code = status_code
-        self.content_length = content_length
+# 结果队列的刷新间隔（毫秒）和每次最多插入的行数
+UI_REFRESH_MS = 200
+UI_BATCH_SIZE = 2000
+# 表格最多显示的行数，超出后移除最早的行，完整结果在结果存储中
+UI_MAX_ROWS = 50000
+
+# 界面上的引擎名称
+ENGINE_NAMES = {"线程": "thread", "异步": "async"}
+# 界面上的DNS预解析方式
+DNS_MODE_NAMES = {"关闭": "off", "标注": "annotate", "跳过": "skip", "后置": "defer"}
+# 增量扫描时各类变化的行颜色
+CHANGE_COLORS = {"appeared": "green", "changed": "blue", "disappeared": "gray"}
 
 class HostCollisionTool:
     def __init__(self, root):
@@ -34,10 +38,21 @@ class HostCollisionTool:
         self.main_domain_list = []
         self.domain_prefix_list = []
         self.subdomain_list = []
-        self.results = []
+        # 从文件导入的输入，去重后保存在磁盘上，文本框只显示预览
+        self.inputs = {}
+        self.input_labels = {}
+        # 碰撞线程结束前输入文件还在读取，导入和清除按钮禁用，后台导入完成也要等碰撞结束再替换
+        self.input_buttons = []
+        self.inputs_in_use = False
+        self.results = ResultStore()
+        self.tree_items = deque()
+        self.tree_index = {}  # (URL, IP) -> 表格行，用于标注变化
         self.is_running = False
         self.completed = 0
         self.total = 0
+        self.runner = None
+        # 工作线程只往队列里放结果和变化，由界面定时批量取出显示
+        self.result_queue = queue.Queue()
         
         # 创建GUI
         self.create_ui()
@@ -61,26 +76,33 @@ class HostCollisionTool:
         ttk.Label(input_frame, text="IP列表 (每行一个):").grid(row=0, column=0, sticky=tk.W, pady=2)
         self.ip_text = scrolledtext.ScrolledText(input_frame, height=4, width=40)
         self.ip_text.grid(row=0, column=1, padx=(5, 10), pady=2)
-        ttk.Button(input_frame, text="导入IP", command=lambda: self.import_file("ip")).grid(row=0, column=2, padx=(5, 0), pady=2)
+        self.make_import_controls(input_frame, "ip", "导入IP").grid(row=0, column=2, padx=(5, 0), pady=2)
         
         # 主域名列表
         ttk.Label(input_frame, text="主域名列表 (每行一个):").grid(row=0, column=3, sticky=tk.W, padx=(20, 0), pady=2)
         self.domain_text = scrolledtext.ScrolledText(input_frame, height=4, width=40)
         self.domain_text.grid(row=0, column=4, padx=(5, 0), pady=2)
-        ttk.Button(input_frame, text="导入域名", command=lambda: self.import_file("domain")).grid(row=0, column=5, padx=(5, 0), pady=2)
+        self.make_import_controls(input_frame, "domain", "导入域名").grid(row=0, column=5, padx=(5, 0), pady=2)
         
         # 第二行：域名前缀和子域名列表并排
         # 域名前缀
         ttk.Label(input_frame, text="域名前缀 (每行一个):").grid(row=1, column=0, sticky=tk.W, pady=2)
         self.prefix_text = scrolledtext.ScrolledText(input_frame, height=4, width=40)
         self.prefix_text.grid(row=1, column=1, padx=(5, 10), pady=2)
-        ttk.Button(input_frame, text="导入前缀", command=lambda: self.import_file("prefix")).grid(row=1, column=2, padx=(5, 0), pady=2)
+        self.make_import_controls(input_frame, "prefix", "导入前缀").grid(row=1, column=2, padx=(5, 0), pady=2)
         
         # 子域名列表
         ttk.Label(input_frame, text="子域名列表 (每行一个):").grid(row=1, column=3, sticky=tk.W, padx=(20, 0), pady=2)
         self.subdomain_text = scrolledtext.ScrolledText(input_frame, height=4, width=40)
         self.subdomain_text.grid(row=1, column=4, padx=(5, 0), pady=2)
-        ttk.Button(input_frame, text="导入子域名", command=lambda: self.import_file("subdomain")).grid(row=1, column=5, padx=(5, 0), pady=2)
+        self.make_import_controls(input_frame, "subdomain", "导入子域名").grid(row=1, column=5, padx=(5, 0), pady=2)
+        
+        self.input_texts = {
+            "ip": self.ip_text,
+            "domain": self.domain_text,
+            "prefix": self.prefix_text,
+            "subdomain": self.subdomain_text,
+        }
         
         # 参数设置
         param_frame = ttk.Frame(input_frame)
@@ -94,18 +116,64 @@ class HostCollisionTool:
         self.port_list = tk.StringVar(value="80,443")
         ttk.Entry(param_frame, textvariable=self.port_list, width=20).grid(row=0, column=3, padx=(0, 20))
         
+        ttk.Label(param_frame, text="引擎:").grid(row=0, column=4, sticky=tk.W, padx=(0, 5))
+        self.engine_type = tk.StringVar(value="异步")
+        ttk.Combobox(param_frame, textvariable=self.engine_type, values=list(ENGINE_NAMES), state="readonly", width=6).grid(row=0, column=5, padx=(0, 20))
+        
         # 控制按钮放在右边
         self.start_button = ttk.Button(param_frame, text="开始碰撞", command=self.start_collision)
-        self.start_button.grid(row=0, column=4, padx=(20, 5))
+        self.start_button.grid(row=0, column=6, padx=(20, 5))
         
         self.stop_button = ttk.Button(param_frame, text="停止碰撞", command=self.stop_collision, state=tk.DISABLED)
-        self.stop_button.grid(row=0, column=5, padx=(0, 5))
+        self.stop_button.grid(row=0, column=7, padx=(0, 5))
         
         self.clear_button = ttk.Button(param_frame, text="清空结果", command=self.clear_results)
-        self.clear_button.grid(row=0, column=6, padx=(0, 5))
+        self.clear_button.grid(row=0, column=8, padx=(0, 5))
         
         self.export_button = ttk.Button(param_frame, text="导出结果", command=self.export_results)
-        self.export_button.grid(row=0, column=7, padx=(0, 0))
+        self.export_button.grid(row=0, column=9, padx=(0, 0))
+        
+        # 第二行：可选功能
+        self.prescan_enabled = tk.BooleanVar(value=True)
+        ttk.Checkbutton(param_frame, text="端口存活预扫描", variable=self.prescan_enabled).grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+        
+        self.baseline_enabled = tk.BooleanVar(value=True)
+        ttk.Checkbutton(param_frame, text="过滤默认站点", variable=self.baseline_enabled).grid(row=1, column=2, columnspan=2, sticky=tk.W, pady=(5, 0))
+        
+        ttk.Label(param_frame, text="正文上限(KB):").grid(row=1, column=4, sticky=tk.W, padx=(0, 5), pady=(5, 0))
+        self.max_body_kb = tk.StringVar(value=str(MAX_BODY_SIZE // 1024))
+        ttk.Entry(param_frame, textvariable=self.max_body_kb, width=8).grid(row=1, column=5, padx=(0, 20), pady=(5, 0))
+        
+        self.resume_enabled = tk.BooleanVar(value=True)
+        ttk.Checkbutton(param_frame, text="断点续扫", variable=self.resume_enabled).grid(row=1, column=6, sticky=tk.W, pady=(5, 0))
+        
+        self.adaptive_enabled = tk.BooleanVar(value=True)
+        ttk.Checkbutton(param_frame, text="自适应并发", variable=self.adaptive_enabled).grid(row=1, column=7, sticky=tk.W, pady=(5, 0))
+        
+        ttk.Label(param_frame, text="限速(次/秒):").grid(row=1, column=8, sticky=tk.W, padx=(0, 5), pady=(5, 0))
+        self.rate_limit = tk.StringVar(value="0")
+        ttk.Entry(param_frame, textvariable=self.rate_limit, width=8).grid(row=1, column=9, pady=(5, 0))
+        
+        # 第三行：证书域名
+        self.cert_harvest_enabled = tk.BooleanVar(value=True)
+        ttk.Checkbutton(param_frame, text="证书域名优先", variable=self.cert_harvest_enabled).grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+        
+        self.cert_names_enabled = tk.BooleanVar(value=False)
+        ttk.Checkbutton(param_frame, text="加入证书新域名", variable=self.cert_names_enabled).grid(row=2, column=2, columnspan=2, sticky=tk.W, pady=(5, 0))
+        
+        # DNS预解析：标注解析地址，或跳过/后置域名已解析到该IP的目标
+        ttk.Label(param_frame, text="DNS预解析:").grid(row=2, column=4, sticky=tk.W, padx=(0, 5), pady=(5, 0))
+        self.dns_mode = tk.StringVar(value="关闭")
+        ttk.Combobox(param_frame, textvariable=self.dns_mode, values=list(DNS_MODE_NAMES), state="readonly", width=6).grid(row=2, column=5, padx=(0, 20), pady=(5, 0))
+        
+        # 超时或连接失败的目标在重试车道中退避重试
+        ttk.Label(param_frame, text="失败重试次数:").grid(row=2, column=6, sticky=tk.W, padx=(0, 5), pady=(5, 0))
+        self.retry_count = tk.StringVar(value=str(DEFAULT_RETRIES))
+        ttk.Entry(param_frame, textvariable=self.retry_count, width=8).grid(row=2, column=7, sticky=tk.W, pady=(5, 0))
+        
+        # 增量扫描：跳过缓存中未过期的未命中目标，完成后显示与上次相比的变化
+        self.cache_enabled = tk.BooleanVar(value=False)
+        ttk.Checkbutton(param_frame, text="增量扫描", variable=self.cache_enabled).grid(row=2, column=8, sticky=tk.W, pady=(5, 0))
         
 
         
@@ -121,6 +189,10 @@ class HostCollisionTool:
         
         self.progress = ttk.Progressbar(status_frame, mode='determinate')
         self.progress.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
+        
+        # 实时运行指标：速率、在途数、首字节延迟和错误分类
+        self.metrics_label = ttk.Label(status_frame, text="指标: -")
+        self.metrics_label.grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
         # 配置状态框架的列权重，让进度条占满整行
         status_frame.columnconfigure(0, weight=1)
         
@@ -132,7 +204,7 @@ class HostCollisionTool:
         main_frame.rowconfigure(2, weight=1)
         
         # 创建Treeview显示结果
-        columns = ('URL', '域名', 'IP', '端口', '标题', '状态码', '内容长度')
+        columns = ('URL', '域名', 'IP', '端口', '标题', '状态码', '内容长度', '解析地址', '变化')
         self.result_tree = ttk.Treeview(result_frame, columns=columns, show='headings', height=6)
         
         # 设置列标题
@@ -152,6 +224,10 @@ class HostCollisionTool:
         result_scrollbar = ttk.Scrollbar(result_frame, orient=tk.VERTICAL, command=self.result_tree.yview)
         self.result_tree.configure(yscrollcommand=result_scrollbar.set)
         
+        # 增量扫描时按变化类型给行上色，消失的结果以灰色行列出
+        for change, color in CHANGE_COLORS.items():
+            self.result_tree.tag_configure(change, foreground=color)
+        
         self.result_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         result_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
         
@@ -167,59 +243,101 @@ class HostCollisionTool:
         self.context_menu.add_separator()
         self.context_menu.add_command(label="复制所有信息", command=self.copy_all_info)
     
+    def make_import_controls(self, parent, file_type, text):
+        # 导入按钮、清除按钮和条数显示
+        frame = ttk.Frame(parent)
+        import_button = ttk.Button(frame, text=text, command=lambda: self.import_file(file_type))
+        import_button.grid(row=0, column=0, sticky=tk.W)
+        clear_button = ttk.Button(frame, text="清除", command=lambda: self.clear_input(file_type))
+        clear_button.grid(row=1, column=0, sticky=tk.W, pady=(2, 0))
+        self.input_buttons += [import_button, clear_button]
+        label = ttk.Label(frame, text="")
+        label.grid(row=2, column=0, sticky=tk.W, pady=(2, 0))
+        self.input_labels[file_type] = label
+        return frame
+    
     def import_file(self, file_type):
         filename = filedialog.askopenfilename(
             title=f"选择{file_type}文件",
             filetypes=[("文本文件", "*.txt"), ("所有文件", "*.*")]
         )
         if filename:
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                
-                if file_type == "ip":
-                    self.ip_text.delete(1.0, tk.END)
-                    self.ip_text.insert(1.0, content)
-                elif file_type == "domain":
-                    self.domain_text.delete(1.0, tk.END)
-                    self.domain_text.insert(1.0, content)
-                elif file_type == "prefix":
-                    self.prefix_text.delete(1.0, tk.END)
-                    self.prefix_text.insert(1.0, content)
-                elif file_type == "subdomain":
-                    self.subdomain_text.delete(1.0, tk.END)
-                    self.subdomain_text.insert(1.0, content)
-                    
-                messagebox.showinfo("成功", f"成功导入{file_type}文件")
-            except Exception as e:
-                messagebox.showerror("错误", f"导入文件失败: {str(e)}")
+            # 大文件的读取和去重放在后台线程，界面不卡顿
+            self.input_labels[file_type].config(text="正在导入...")
+            thread = threading.Thread(target=self.load_file, args=(file_type, filename))
+            thread.daemon = True
+            thread.start()
+    
+    def load_file(self, file_type, filename):
+        try:
+            input_list = load_input(file_type, [filename])
+        except Exception as e:
+            self.root.after(0, self.file_failed, file_type, e)
+            return
+        self.root.after(0, self.file_loaded, file_type, filename, input_list)
+    
+    def file_failed(self, file_type, error):
+        self.input_labels[file_type].config(text="")
+        messagebox.showerror("错误", f"导入文件失败: {str(error)}")
+    
+    def file_loaded(self, file_type, filename, input_list):
+        # 文本框只显示前若干行预览并设为只读，完整内容在磁盘上
+        if self.inputs_in_use:
+            self.root.after(UI_REFRESH_MS, self.file_loaded, file_type, filename, input_list)
+            return
+        self.clear_input(file_type)
+        self.inputs[file_type] = input_list
+        text = self.input_texts[file_type]
+        preview = input_list.preview()
+        text.insert(1.0, '\n'.join(preview))
+        if len(input_list) > len(preview):
+            text.insert(tk.END, f"\n... 共{len(input_list)}条")
+        text.config(state=tk.DISABLED)
+        self.input_labels[file_type].config(text=f"{os.path.basename(filename)}：去重后{len(input_list)}条")
+        messagebox.showinfo("成功", f"成功导入{file_type}文件，去重后{len(input_list)}条")
+    
+    def clear_input(self, file_type):
+        # 删除导入的文件数据，恢复为手动输入
+        input_list = self.inputs.pop(file_type, None)
+        if input_list:
+            input_list.close()
+        text = self.input_texts[file_type]
+        text.config(state=tk.NORMAL)
+        text.delete(1.0, tk.END)
+        self.input_labels[file_type].config(text="")
+    
+    def read_input(self, file_type):
+        # 导入的文件直接使用磁盘上的去重结果，否则读取文本框内容并去重
+        if file_type in self.inputs:
+            return self.inputs[file_type]
+        return dedupe(file_type, self.input_texts[file_type].get(1.0, tk.END).split('\n'))
     
     def export_results(self):
-        if not self.results:
+        if not len(self.results) and not self.is_running:
             messagebox.showwarning("警告", "没有结果可导出")
             return
             
         filename = filedialog.asksaveasfilename(
             title="保存结果",
             defaultextension=".csv",
-            filetypes=[("CSV文件", "*.csv"), ("所有文件", "*.*")]
+            filetypes=[("CSV文件", "*.csv"), ("JSON行文件", "*.jsonl"), ("所有文件", "*.*")]
         )
         if filename:
             try:
-                with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(['URL', '域名', 'IP', '端口', '标题', '状态码', '内容长度'])
-                    for result in self.results:
-                        writer.writerow([
-                            result.url, result.domain, result.ip, result.port,
-                            result.title, result.status_code, result.content_length
-                        ])
-                messagebox.showinfo("成功", f"结果已导出到: {filename}")
+                # 从结果存储流式写出；碰撞进行中时保持打开，新结果随到随写，碰撞结束后关闭
+                self.results.attach(open_exporter(filename))
+                if self.is_running:
+                    messagebox.showinfo("成功", f"已有结果已导出到: {filename}\n碰撞结束前的新结果会继续写入该文件")
+                else:
+                    self.results.detach_all()
+                    messagebox.showinfo("成功", f"结果已导出到: {filename}")
             except Exception as e:
                 messagebox.showerror("错误", f"导出失败: {str(e)}")
     
     def clear_results(self):
         self.results.clear()
+        self.tree_items.clear()
+        self.tree_index.clear()
         for item in self.result_tree.get_children():
             self.result_tree.delete(item)
         self.stats_label.config(text="结果数: 0")
@@ -229,10 +347,10 @@ class HostCollisionTool:
             return
             
         # 获取输入数据
-        self.ip_list = [ip.strip() for ip in self.ip_text.get(1.0, tk.END).strip().split('\n') if ip.strip()]
-        self.main_domain_list = [domain.strip() for domain in self.domain_text.get(1.0, tk.END).strip().split('\n') if domain.strip()]
-        self.domain_prefix_list = [prefix.strip() for prefix in self.prefix_text.get(1.0, tk.END).strip().split('\n') if prefix.strip()]
-        self.subdomain_list = [subdomain.strip() for subdomain in self.subdomain_text.get(1.0, tk.END).strip().split('\n') if subdomain.strip()]
+        self.ip_list = self.read_input("ip")
+        self.main_domain_list = self.read_input("domain")
+        self.domain_prefix_list = self.read_input("prefix")
+        self.subdomain_list = self.read_input("subdomain")
         
         if not self.ip_list:
             messagebox.showwarning("警告", "请输入IP列表")
@@ -245,8 +363,10 @@ class HostCollisionTool:
         # 验证参数
         try:
             thread_count = int(self.thread_count.get())
-            if thread_count < 1 or thread_count > 1000:
-                raise ValueError("线程数必须在1-1000之间")
+            engine = ENGINE_NAMES[self.engine_type.get()]
+            max_count = MAX_CONCURRENCY[engine]
+            if thread_count < 1 or thread_count > max_count:
+                raise ValueError(f"线程数必须在1-{max_count}之间")
         except ValueError as e:
             messagebox.showerror("错误", f"线程数设置错误: {str(e)}")
             return
@@ -260,13 +380,55 @@ class HostCollisionTool:
             messagebox.showerror("错误", f"端口设置错误: {str(e)}")
             return
         
-        # 生成目标列表
-        targets = self.generate_targets()
-        if not targets:
+        try:
+            max_body = int(self.max_body_kb.get()) * 1024
+            if max_body < 1:
+                raise ValueError("正文上限必须大于0")
+        except ValueError as e:
+            messagebox.showerror("错误", f"正文上限设置错误: {str(e)}")
+            return
+        
+        try:
+            rate_limit = float(self.rate_limit.get())
+            if rate_limit < 0:
+                raise ValueError("限速不能小于0")
+        except ValueError as e:
+            messagebox.showerror("错误", f"限速设置错误: {str(e)}")
+            return
+        
+        try:
+            retries = int(self.retry_count.get())
+            if retries < 0:
+                raise ValueError("重试次数不能小于0")
+        except ValueError as e:
+            messagebox.showerror("错误", f"重试次数设置错误: {str(e)}")
+            return
+        
+        # 目标总数直接计算，预扫描后会按存活端点重新计算
+        runner = CollisionRunner(
+            self.ip_list, ports,
+            subdomains=self.subdomain_list,
+            main_domains=self.main_domain_list,
+            prefixes=self.domain_prefix_list,
+            engine=engine,
+            concurrency=thread_count,
+            max_body=max_body,
+            prescan=self.prescan_enabled.get(),
+            baseline=self.baseline_enabled.get(),
+            journal_file=JOURNAL_FILE if self.resume_enabled.get() else None,
+            rate_limit=rate_limit,
+            adaptive=self.adaptive_enabled.get(),
+            cert_harvest=self.cert_harvest_enabled.get(),
+            cert_names=self.cert_names_enabled.get(),
+            dns_mode=DNS_MODE_NAMES[self.dns_mode.get()],
+            retries=retries,
+            cache_file=CACHE_FILE if self.cache_enabled.get() else None
+        )
+        self.total = runner.total
+        if not self.total:
             messagebox.showwarning("警告", "没有生成任何目标")
             return
         
-        self.total = len(targets)
         self.completed = 0
         self.progress['maximum'] = self.total
         self.progress['value'] = 0
@@ -274,153 +436,135 @@ class HostCollisionTool:
         
         # 启动碰撞线程
         self.is_running = True
+        self.inputs_in_use = True
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
+        for button in self.input_buttons:
+            button.config(state=tk.DISABLED)
         
-        collision_thread = threading.Thread(target=self.run_collision, args=(targets, thread_count, ports))
+        self.runner = runner
+        collision_thread = threading.Thread(target=self.run_collision, args=(runner,))
         collision_thread.daemon = True
         collision_thread.start()
+        self.root.after(UI_REFRESH_MS, self.refresh_display)
     
     def stop_collision(self):
+        # 只发出停止信号，引擎取消在途探测后由collision_finished恢复按钮
         self.is_running = False
-        self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
-        self.status_label.config(text="状态: 已停止")
+        self.status_label.config(text="状态: 正在停止...")
     
-    def generate_targets(self):
-        targets = []
-        
-        # 获取用户设置的端口列表
+    def run_collision(self, runner):
+        # 碰撞流程全部在CollisionRunner中完成，界面只负责显示
+        # 出错时（例如断点或缓存文件打不开）也要恢复界面，否则会一直停在运行状态
+        finished = False
+        error = None
         try:
-            ports = [int(p.strip()) for p in self.port_list.get().split(',') if p.strip()]
-        except ValueError:
-            ports = [80, 443]  # 默认端口
-        
-        # 从子域名列表生成目标
-        for subdomain in self.subdomain_list:
-            for ip in self.ip_list:
-                for port in ports:
-                    targets.append((subdomain, ip, port))
-        
-        # 从主域名和前缀生成目标
-        for main_domain in self.main_domain_list:
-            for prefix in self.domain_prefix_list:
-                subdomain = f"{prefix}.{main_domain}"
-                for ip in self.ip_list:
-                    for port in ports:
-                        targets.append((subdomain, ip, port))
-        
-        return targets
+            finished = runner.run(
+                on_result=self.handle_result,
+                on_status=lambda text: self.root.after(0, self.update_status, text),
+                on_total=lambda total: self.root.after(0, self.update_total, total),
+                should_stop=lambda: not self.is_running,
+                on_change=self.handle_change
+            )
+        except Exception as e:
+            error = e
+        finally:
+            self.root.after(0, self.collision_finished, finished, error)
     
-    def run_collision(self, targets, thread_count, ports):
-        # 使用线程池执行碰撞检测
-        with ThreadPoolExecutor(max_workers=thread_count) as executor:
-            futures = []
-            for target in targets:
-                if not self.is_running:
-                    break
-                future = executor.submit(self.check_target, target[0], target[1], target[2])
-                futures.append(future)
-            
-            # 等待所有任务完成
-            for future in futures:
-                if not self.is_running:
-                    break
-                try:
-                    result = future.result(timeout=30)
-                    if result:
-                        self.results.append(result)
-                        # 在主线程中更新UI
-                        self.root.after(0, self.update_result_display, result)
-                except Exception as e:
-                    print(f"检查目标时出错: {e}")
-        
-        # 碰撞完成
-        self.root.after(0, self.collision_finished)
+    def update_status(self, text):
+        if self.is_running:
+            self.status_label.config(text=f"状态: {text}")
+    
+    def update_total(self, total):
+        self.total = total
+        self.progress['maximum'] = max(total, 1)
+    
+    def handle_result(self, result):
+        # 在工作线程中调用，结果写入存储（超出内存上限时落盘）后入队，不碰界面
+        self.results.add(result)
+        self.result_queue.put((None, result, None))
     
-    def check_target(self, domain, ip, port):
-        # 定义协议尝试顺序
-        protocols_to_try = []
-        
-        # 根据端口确定协议尝试顺序
-        if port == 443:
-            protocols_to_try = ['https']  # 443端口只探测HTTPS
-        elif port == 80:
-            protocols_to_try = ['http']   # 80端口只探测HTTP
-        else:
-            # 对于其他端口，尝试两种协议
-            protocols_to_try = ['http', 'https']
-        
-        for protocol in protocols_to_try:
+    def handle_change(self, change, result, previous):
+        # 增量扫描时与上次相比的变化，和结果走同一个队列，保证标注时结果行已经插入
+        self.result_queue.put((change, result, previous))
+    
+    def refresh_display(self):
+        self.drain_results(UI_BATCH_SIZE)
+        if self.is_running:
+            self.root.after(UI_REFRESH_MS, self.refresh_display)
+    
+    def drain_results(self, limit=None):
+        # 批量取出队列中的结果插入表格，进度按已完成的探测数计算
+        last_item = None
+        count = 0
+        while limit is None or count < limit:
             try:
-                # 构建URL
-                url = f"{protocol}://{domain}:{port}"
-                
-                # 设置请求头
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    'Host': domain
-                }
-                
-                # 发送请求
-                response = requests.get(url, headers=headers, timeout=10, allow_redirects=False)
-                
-                # 提取标题
-                title = ""
-                content_length = len(response.content)
-                
-                if response.status_code == 200 and 'text/html' in response.headers.get('content-type', ''):
-                    try:
-                        soup = BeautifulSoup(response.content, 'html.parser')
-                        title_tag = soup.find('title')
-                        if title_tag:
-                            title = title_tag.get_text().strip()
-                    except:
-                        pass
-                
-                # 创建结果对象
-                result = CollisionResult(
-                    url=url,
-                    domain=domain,
-                    ip=ip,
-                    port=port,
-                    title=title,
-                    status_code=response.status_code,
-                    content_length=content_length
-                )
-                
-                return result
-                
-            except requests.exceptions.RequestException:
-                # 请求失败，继续尝试下一个协议
-                continue
-            except Exception as e:
-                print(f"检查目标 {domain}:{port} ({protocol}) 时出错: {e}")
-                continue
+                change, result, previous = self.result_queue.get_nowait()
+            except queue.Empty:
+                break
+            count += 1
+            if change is None:
+                last_item = self.insert_row(result)
+                self.tree_index[(result.url, result.ip)] = last_item
+            elif change == 'disappeared':
+                last_item = self.insert_row(previous, change)
+            else:
+                self.mark_change(change, result, previous)
+        
+        # 表格只保留最近的结果，避免界面占用内存无限增长
+        while len(self.tree_items) > UI_MAX_ROWS:
+            item = self.tree_items.popleft()
+            values = self.result_tree.item(item, 'values')
+            if self.tree_index.get((values[0], values[2])) == item:
+                del self.tree_index[(values[0], values[2])]
+            self.result_tree.delete(item)
         
-        # 所有协议都失败，返回None
-        return None
-    
-    def update_result_display(self, result):
-        # 更新进度
-        self.completed += 1
+        if self.runner:
+            self.completed = self.runner.completed
+            self.metrics_label.config(text=f"指标: {self.runner.metrics.summary()}")
         self.progress['value'] = self.completed
         self.stats_label.config(text=f"结果数: {len(self.results)}")
         
-        # 添加到结果列表
-        self.result_tree.insert('', 'end', values=(
-            result.url, result.domain, result.ip, result.port,
-            result.title, result.status_code, result.content_length
-        ))
-        
         # 自动滚动到底部
-        self.result_tree.see(self.result_tree.get_children()[-1])
+        if last_item:
+            self.result_tree.see(last_item)
+    
+    def insert_row(self, result, change=None):
+        item = self.result_tree.insert('', 'end', values=(
+            result.url, result.domain, result.ip, result.port, result.title,
+            result.status_code, result.content_length, result.resolved, CHANGE_NAMES.get(change, '')
+        ), tags=(change,) if change else ())
+        self.tree_items.append(item)
+        return item
+    
+    def mark_change(self, change, result, previous):
+        # 新增和变化的结果行已经在表格里，补上变化类型并上色；变化的结果注明上次的状态码和标题
+        item = self.tree_index.get((result.url, result.ip))
+        if item is None:
+            return
+        text = CHANGE_NAMES[change]
+        if change == 'changed':
+            text += f"（上次{previous.status_code} {previous.title}）"
+        self.result_tree.set(item, '变化', text)
+        self.result_tree.item(item, tags=(change,))
     
-    def collision_finished(self):
+    def collision_finished(self, finished=True, error=None):
+        self.drain_results()
+        self.results.detach_all()
         self.is_running = False
+        self.inputs_in_use = False
         self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
-        self.status_label.config(text=f"状态: 碰撞完成，共检查{self.completed}个目标，发现{len(self.results)}个结果")
+        for button in self.input_buttons:
+            button.config(state=tk.NORMAL)
+        state = "碰撞完成" if finished else "已停止"
+        self.status_label.config(text=f"状态: {state}，共检查{self.completed}个目标，发现{len(self.results)}个结果，超时放弃{self.runner.abandoned}个，"
+                                       f"重试{self.runner.retried}次，重试后仍失败{self.runner.given_up}个"
+                                       + (f"；与上次相比{self.runner.cache.summary()}" if self.runner.cache else ""))
+        if error:
+            self.status_label.config(text=f"状态: 碰撞出错，共检查{self.completed}个目标，发现{len(self.results)}个结果")
+            messagebox.showerror("错误", f"碰撞出错: {str(error)}")
 
     def show_context_menu(self, event):
         try:
@@ -512,8 +656,9 @@ class HostCollisionTool:
             title = item_values[4]
             status_code = item_values[5]
             content_length = item_values[6]
+            resolved = item_values[7]
 
-            all_info = f"URL: {url}\n域名: {domain}\nIP: {ip}\n端口: {port}\n标题: {title}\n状态码: {status_code}\n内容长度: {content_length}"
+            all_info = f"URL: {url}\n域名: {domain}\nIP: {ip}\n端口: {port}\n标题: {title}\n状态码: {status_code}\n内容长度: {content_length}\n解析地址: {resolved}"
             self.root.clipboard_clear()
             self.root.clipboard_append(all_info)
             self.root.update()
@@ -525,6 +670,10 @@ def main():
     root = tk.Tk()
     app = HostCollisionTool(root)
     root.mainloop()
+    # 删除落盘的临时结果文件和导入的输入文件
+    app.results.close()
+    for input_list in app.inputs.values():
+        input_list.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
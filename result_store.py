@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from collision_engine import CollisionResult, RESULT_FIELDS
+
+# 内存中最多保留的结果数，超出后批量写入磁盘
+MEMORY_LIMIT = 10000
+# 从磁盘分页读取的行数
+PAGE_SIZE = 1000
+
+CSV_HEADER = ['URL', '域名', 'IP', '端口', '标题', '状态码', '内容长度', '解析地址']
+
+# CSV导出，每条结果立即写入文件
+class CsvExporter:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(CSV_HEADER)
+
+    def write(self, result):
+        self.writer.writerow([getattr(result, field) for field in RESULT_FIELDS])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# JSON行导出，每条结果一行
+class JsonlExporter:
+    def __init__(self, path=None, file=None):
+        self.file = file or open(path, 'w', encoding='utf-8')
+
+    def write(self, result):
+        self.file.write(json.dumps(result.to_dict(), ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def open_exporter(path):
+    # 按扩展名选择导出格式，.csv为CSV，其余为JSON行
+    if path.lower().endswith('.csv'):
+        return CsvExporter(path)
+    return JsonlExporter(path)
+
+# 结果存储：少量结果放内存，超过阈值后写入临时SQLite文件，遍历时按顺序流式读取
+class ResultStore:
+    def __init__(self, memory_limit=MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        self.buffer = []
+        self.count = 0
+        self.conn = None
+        self.path = None
+        self.exporters = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def add(self, result):
+        with self.lock:
+            self.buffer.append(result)
+            self.count += 1
+            for exporter in self.exporters:
+                exporter.write(result)
+            if len(self.buffer) >= self.memory_limit:
+                self._spill()
+
+    def _spill(self):
+        if self.conn is None:
+            fd, self.path = tempfile.mkstemp(prefix='collision_results_', suffix='.db')
+            os.close(fd)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute(f"CREATE TABLE results ({', '.join(RESULT_FIELDS)})")
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO results VALUES ({', '.join('?' * len(RESULT_FIELDS))})",
+                [tuple(getattr(result, field) for field in RESULT_FIELDS) for result in self.buffer]
+            )
+        self.buffer = []
+
+    def _page(self, last):
+        if self.conn is None:
+            return []
+        return self.conn.execute(
+            f"SELECT rowid, {', '.join(RESULT_FIELDS)} FROM results WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last, PAGE_SIZE)
+        ).fetchall()
+
+    def attach(self, exporter):
+        # 先写出已有结果，之后的新结果随到随写；持锁期间新结果会等待，保证不重不漏
+        with self.lock:
+            last = 0
+            while True:
+                rows = self._page(last)
+                if not rows:
+                    break
+                for row in rows:
+                    exporter.write(CollisionResult(*row[1:]))
+                last = rows[-1][0]
+            for result in self.buffer:
+                exporter.write(result)
+            self.exporters.append(exporter)
+
+    def detach_all(self):
+        with self.lock:
+            exporters, self.exporters = self.exporters, []
+        for exporter in exporters:
+            exporter.close()
+
+    def clear(self):
+        with self.lock:
+            self.buffer = []
+            self.count = 0
+            self._drop_disk()
+
+    def close(self):
+        self.detach_all()
+        with self.lock:
+            self._drop_disk()
+
+    def _drop_disk(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            os.remove(self.path)
+            self.path = None